@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+# compare the memory used per point by InfluxResult objects
+import sys
+import argparse
+
+from serialize import build_points
+from pyVsphereInflux import compact_results
+
+class DictResult(object):
+    """InfluxResult as it was before __slots__, for comparison"""
+    def __init__(self, measurement, tags=None, timestamp=None, fields=None):
+        self.measurement = measurement
+        self.tags = tags or {}
+        self.timestamp = timestamp
+        self.fields = fields or {}
+
+def deep_size(points):
+    """Sum the size of the points and every object they reference, counting
+       shared objects once"""
+    seen = set()
+    total = 0
+    stack = list(points)
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        total += sys.getsizeof(obj)
+
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif hasattr(obj, '__dict__'):
+            stack.append(obj.__dict__)
+        elif hasattr(obj, '__slots__'):
+            stack.extend(getattr(obj, x) for x in
+                         ('measurement', 'tags', 'timestamp', 'fields'))
+    return total
+
+def main():
+    parser = argparse.ArgumentParser(description="benchmark point memory use")
+    parser.add_argument('--points', type=int, default=100000,
+                        help="number of points (default: 100000)")
+    args = parser.parse_args()
+
+    dict_points = build_points(args.points, cls=DictResult)
+    print "%-18s %6d bytes/point" % \
+        ("dict attributes", deep_size(dict_points) / args.points)
+    del dict_points
+
+    points = build_points(args.points)
+    print "%-18s %6d bytes/point" % \
+        ("__slots__", deep_size(points) / args.points)
+
+    compact_results(points)
+    print "%-18s %6d bytes/point" % \
+        ("__slots__ compact", deep_size(points) / args.points)
+
+if __name__ == '__main__':
+    sys.exit(main())
+
+# vim: et:ai:sw=4:ts=4
@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+# compare parsing a query response into objects and into frames
+import sys
+import time
+import random
+import argparse
+
+from pyVsphereInflux import InfluxResult08
+from pyVsphereInflux.frame import frames_from_query
+
+def build_response(series, points):
+    """Build a response shaped like the daily means the reporting scripts
+       query"""
+    res = []
+    for s in range(series):
+        rows = []
+        for p in range(points):
+            rows.append([1450000000 + p * 86400, p,
+                         random.random() * 2**40, 2.0**41])
+        res.append({'name': 'xioprop.xms%d.cluster' % s,
+                    'columns': ['time', 'sequence_number', 'used',
+                                'capacity'],
+                    'points': rows})
+    return res
+
+def bench(name, func, res, repeat):
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        func(res)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    print "%-18s %8.3f sec" % (name, best)
+
+def main():
+    parser = argparse.ArgumentParser(description="benchmark query parsing")
+    parser.add_argument('--series', type=int, default=1000,
+                        help="number of series (default: 1000)")
+    parser.add_argument('--points', type=int, default=1000,
+                        help="number of points per series (default: 1000)")
+    parser.add_argument('--repeat', type=int, default=3,
+                        help="number of runs, the best is reported")
+    args = parser.parse_args()
+
+    res = build_response(args.series, args.points)
+    print "%d rows" % (args.series * args.points)
+    bench("from_query", InfluxResult08.from_query, res, args.repeat)
+    bench("frames_from_query", frames_from_query, res, args.repeat)
+
+if __name__ == '__main__':
+    sys.exit(main())
+
+# vim: et:ai:sw=4:ts=4
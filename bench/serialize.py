@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+# compare the cost of serializing points with to_dict and to_line, and the
+# size of what each writer sends
+import sys
+import time
+import json
+import zlib
+import argparse
+
+from pyVsphereInflux import InfluxResult08
+from pyVsphereInflux.batch import InfluxBatch
+
+def build_points(count, cls=InfluxResult08):
+    """Build points shaped like the output of vsphere-influxdb-import.py"""
+    points = []
+    for i in range(count):
+        ts = cls("vmprop.vc01.DC1.Folder_%d.vm-%d" % (i % 300, i))
+        ts.tags['name'] = "vm-%d" % i
+        ts.tags['folderPath'] = "/Folder %d/sub" % (i % 300)
+        ts.tags['vcenter'] = "vc01.example.com"
+        ts.tags['datacenter'] = "DC1"
+        ts.tags['topLevelFolder'] = "Folder %d" % (i % 300)
+        ts.fields['config.hardware.numCPU'] = 2
+        ts.fields['config.hardware.memoryMB'] = 4096
+        ts.fields['guest.guestState'] = "running"
+        ts.fields['summary.storage.committed'] = 53687091200 + i
+        ts.timestamp = 1450000000
+        points.append(ts)
+    return points
+
+def bench(name, func, points, repeat):
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        func(points)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    print "%-12s %8.3f sec  %10.0f points/sec" % \
+        (name, best, len(points) / best)
+
+def payload_sizes(points):
+    """Print the bytes sent for the points by each writer: the JSON body of
+       the 0.8 client, and the gzip compressed lines of LineProtocolWriter"""
+    body = json.dumps([x.to_dict() for x in points])
+    print "%-12s %12d bytes" % ("json", len(body))
+    lines = "\n".join(x.to_line() for x in points)
+    print "%-12s %12d bytes" % ("lines", len(lines))
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    body = compressor.compress(lines) + compressor.flush()
+    print "%-12s %12d bytes" % ("lines gzip", len(body))
+
+def main():
+    parser = argparse.ArgumentParser(description="benchmark point serialization")
+    parser.add_argument('--points', type=int, default=100000,
+                        help="number of points (default: 100000)")
+    parser.add_argument('--repeat', type=int, default=3,
+                        help="number of runs, the best is reported")
+    args = parser.parse_args()
+
+    points = build_points(args.points)
+    bench("to_dict", lambda p: [x.to_dict() for x in p], points, args.repeat)
+    # the influxdb 0.8 client JSON encodes the dicts before sending them
+    bench("to_dict+json", lambda p: json.dumps([x.to_dict() for x in p]),
+          points, args.repeat)
+    bench("to_line", lambda p: [x.to_line() for x in p], points, args.repeat)
+    bench("to_line ns", lambda p: [x.to_line('ns') for x in p], points,
+          args.repeat)
+
+    batch = InfluxBatch.from_results(points)
+    bench("batch dicts", lambda b: b.to_dicts(), batch, args.repeat)
+    bench("batch lines", lambda b: b.to_lines(), batch, args.repeat)
+
+    payload_sizes(points)
+
+if __name__ == '__main__':
+    sys.exit(main())
+
+# vim: et:ai:sw=4:ts=4
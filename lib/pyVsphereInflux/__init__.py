@@ -1,4 +1,96 @@
+import math
+
+from pyVsphereInflux.tools.regex import series_keys
+
+# multipliers from timestamps in seconds to each line protocol precision
+PRECISION_FACTORS = {'s': 1, 'ms': 10**3, 'u': 10**6, 'ns': 10**9}
+
+def strip_newlines(s):
+    """Replace the newlines in a string with spaces, as the line protocol has
+       no way to escape them"""
+    if "\n" in s or "\r" in s:
+        s = s.replace("\r\n", " ").replace("\n", " ").replace("\r", " ")
+    return s
+
+def escape_measurement(s):
+    """Escape a measurement name for the line protocol"""
+    s = strip_newlines(s)
+    if "," in s or " " in s:
+        s = s.replace(",", "\\,").replace(" ", "\\ ")
+    return s
+
+def escape_key(s):
+    """Escape a tag key or field key for the line protocol, returned with the
+       trailing = ready to prefix the value"""
+    return escape_tag_value(s) + "="
+
+def escape_tag_value(s):
+    """Escape a tag value for the line protocol"""
+    if not isinstance(s, basestring):
+        s = str(s)
+    s = strip_newlines(s)
+    if "," in s or "=" in s or " " in s:
+        s = s.replace(",", "\\,").replace("=", "\\=").replace(" ", "\\ ")
+    return s
+
+def _format_string(v):
+    """Format a string field value for the line protocol"""
+    return '"%s"' % strip_newlines(v).replace("\\", "\\\\") \
+                                     .replace('"', '\\"')
+
+_field_formatters = {
+    bool: lambda v: "true" if v else "false",
+    int: lambda v: "%di" % v,
+    long: lambda v: "%di" % v,
+    float: repr,
+    str: _format_string,
+    unicode: _format_string,
+}
+
+def is_writable(v):
+    """Whether a field value can be written, InfluxDB rejecting NaN and
+       infinite floats"""
+    if v is None:
+        return False
+    if isinstance(v, float):
+        return not (math.isnan(v) or math.isinf(v))
+    return True
+
+def format_field_value(v):
+    """Format a field value for the line protocol"""
+    try:
+        return _field_formatters[type(v)](v)
+    except KeyError:
+        pass
+
+    # subclasses of the basic types
+    if isinstance(v, bool):
+        return "true" if v else "false"
+    elif isinstance(v, (int, long)):
+        return "%di" % v
+    elif isinstance(v, float):
+        return repr(float(v))
+    elif isinstance(v, basestring):
+        return _format_string(v)
+    else:
+        return _format_string(str(v))
+
+def format_timestamp(ts, precision='s'):
+    """Convert a timestamp in seconds to an integer in the given precision"""
+    factor = PRECISION_FACTORS[precision]
+    if isinstance(ts, (int, long)):
+        return ts * factor
+    return int(round(ts * factor))
+
+def compact_results(results):
+    """Compact every result in a list, see InfluxResult.compact"""
+    for ts in results:
+        ts.compact()
+
 class InfluxResult(object):
+    # no per object __dict__, there can be hundreds of thousands of these
+    __slots__ = ('measurement', 'tags', 'timestamp', 'fields')
+
     def __init__(self, measurement, tags=None, timestamp=None, fields=None):
         self.measurement = measurement
 
@@ -26,11 +118,51 @@ class InfluxResult(object):
 
         return ret
 
+    def to_line(self, precision='s'):
+        """Convert to a line as expected by the InfluxDB 1.x line protocol,
+           or None if there are no fields to write
+                Arguments:
+                    precision: the precision of the timestamp, one of the
+                               keys of PRECISION_FACTORS
+        """
+        fields = [escape_key(key) + format_field_value(value)
+                  for key, value in sorted(self.fields.items())
+                  if is_writable(value)]
+        if not fields:
+            return None
+
+        # sorted tags are cheaper for the server to index, and empty tag
+        # values are not allowed
+        parts = [escape_measurement(self.measurement)]
+        parts.extend([escape_key(key) + escape_tag_value(value)
+                      for key, value in sorted(self.tags.items())
+                      if value is not None and value != ""])
+
+        line = "%s %s" % (",".join(parts), ",".join(fields))
+        if self.timestamp:
+            line = "%s %d" % (line, format_timestamp(self.timestamp, precision))
+
+        return line
+
+    def compact(self):
+        """Reduce the memory used by the result by interning the tag and
+           field keys and the tag values in the shared series key registry,
+           as they repeat across results even though whole tag sets rarely
+           do"""
+        self.tags = series_keys.tags(self.tags)
+        self.fields = dict((series_keys.intern(k), v)
+                           for k, v in self.fields.iteritems())
+
 class InfluxResult08(InfluxResult):
+    __slots__ = ()
+
     @staticmethod
-    def query(client, query):
+    def query(client, query, cache=None):
         """Query InfluxDB using the client and return a list of InfluxResult08
-           objects a la from_query"""
+           objects a la from_query.  If cache is a QueryCache, the result is
+           read from or saved to it."""
+        if cache is not None:
+            return InfluxResult08.from_query(cache.query(client, query))
         return InfluxResult08.from_query(client.query(query))
 
     @staticmethod
@@ -40,16 +172,21 @@ class InfluxResult08(InfluxResult):
            points, returns a list of InfluxResult08 objects"""
         ret = []
         for series in query_res:
+            # find the column positions once per series rather than per cell
+            time_pos = None
+            field_pos = []
+            for i, column in enumerate(series['columns']):
+                if column == 'time':
+                    time_pos = i
+                elif column != 'sequence_number':
+                    field_pos.append((i, column))
+
             for row in series['points']:
                 ts = InfluxResult08(series['name'])
-
-                for i in range(len(series['columns'])):
-                    if series['columns'][i] == 'time':
-                        ts.timestamp = row[i]
-                    elif series['columns'][i] == 'sequence_number':
-                        continue
-                    else:
-                        ts.fields[series['columns'][i]] = row[i]
+                if time_pos is not None:
+                    ts.timestamp = row[time_pos]
+                for i, column in field_pos:
+                    ts.fields[column] = row[i]
 
                 ret.append(ts)
 
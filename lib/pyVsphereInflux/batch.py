@@ -0,0 +1,262 @@
+"""Columnar storage for large numbers of points"""
+import numpy as np
+
+from pyVsphereInflux import InfluxResult08, escape_measurement, escape_key, \
+                            escape_tag_value, format_field_value, \
+                            format_timestamp, is_writable
+
+# marks a tag or field that a row does not have, as distinct from None
+MISSING = object()
+
+class InfluxBatch(object):
+    """Points stored as parallel columns instead of one InfluxResult each.
+       Numeric fields present in every row are NumPy arrays, any other tag
+       or field column is a list with MISSING for rows without it.
+
+       Iterating over a batch yields InfluxBatchRow views, which have the
+       same attributes as an InfluxResult.
+    """
+    def __init__(self, measurements, tags=None, fields=None, timestamps=None):
+        """
+            Arguments:
+                measurements: a list of measurement names, one per row
+                tags: a dict of tag name to column
+                fields: a dict of field name to column
+                timestamps: a column of timestamps in seconds, or None
+        """
+        self.measurements = measurements
+        self.tags = tags or {}
+        self.fields = fields or {}
+        self.timestamps = timestamps
+
+    @staticmethod
+    def from_results(results):
+        """Build a batch from InfluxResult objects"""
+        results = list(results)
+        n = len(results)
+
+        tags = {}
+        fields = {}
+        timestamps = [MISSING] * n
+        has_timestamps = False
+        for i, ts in enumerate(results):
+            for key, value in ts.tags.iteritems():
+                if key not in tags:
+                    tags[key] = [MISSING] * n
+                tags[key][i] = value
+            for key, value in ts.fields.iteritems():
+                if key not in fields:
+                    fields[key] = [MISSING] * n
+                fields[key][i] = value
+            if ts.timestamp:
+                timestamps[i] = ts.timestamp
+                has_timestamps = True
+
+        for key in fields:
+            fields[key] = to_column(fields[key])
+
+        if has_timestamps:
+            timestamps = to_column(timestamps)
+        else:
+            timestamps = None
+
+        return InfluxBatch([ts.measurement for ts in results], tags=tags,
+                           fields=fields, timestamps=timestamps)
+
+    def __len__(self):
+        return len(self.measurements)
+
+    def __iter__(self):
+        for i in xrange(len(self)):
+            yield InfluxBatchRow(self, i)
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return InfluxBatchRow(self, i)
+
+    def to_results(self):
+        """Convert to a list of InfluxResult08 objects"""
+        return [row.to_result() for row in self]
+
+    def group_indices(self, keys):
+        """Group the rows by the values of some tags
+                Arguments:
+                    keys: a list of tag names
+                Results:
+                    a dict of tuples of tag values to NumPy arrays of the
+                    indexes of the rows with those values.  Rows missing any
+                    of the tags are left out.
+        """
+        columns = [self.tags.get(key, [MISSING] * len(self)) for key in keys]
+        groups = {}
+        for i, values in enumerate(zip(*columns)):
+            if MISSING in values:
+                continue
+            groups.setdefault(values, []).append(i)
+
+        return dict((k, np.array(v, dtype=np.intp))
+                    for k, v in groups.iteritems())
+
+    def to_dicts(self):
+        """Convert to a list of dicts as expected by the influxdb 0.8 module,
+           as InfluxResult08.to_dict"""
+        field_cols = [(key, column_values(col))
+                      for key, col in self.fields.iteritems()]
+        tag_cols = self.tags.items()
+        if self.timestamps is not None:
+            timestamps = column_values(self.timestamps)
+        else:
+            timestamps = None
+
+        ret = []
+        for i, meas in enumerate(self.measurements):
+            columns = []
+            point = []
+            for key, col in field_cols:
+                if col[i] is not MISSING:
+                    point.append(col[i])
+                    columns.append(key)
+            for key, col in tag_cols:
+                if col[i] is not MISSING:
+                    point.append(col[i])
+                    columns.append(key)
+            if timestamps is not None and timestamps[i] is not MISSING:
+                point.insert(0, timestamps[i])
+                columns.insert(0, "time")
+
+            ret.append({'name': meas, 'columns': columns, 'points': [point]})
+
+        return ret
+
+    def to_lines(self, precision='s'):
+        """Convert to a list of lines as InfluxResult.to_line, formatting
+           each column as a whole"""
+        n = len(self)
+
+        # "key=value" strings for each column, or None where a row has no
+        # value to write
+        field_parts = []
+        for key in sorted(self.fields):
+            prefix = escape_key(key)
+            values = column_values(self.fields[key])
+            field_parts.append([prefix + format_field_value(v)
+                                if v is not MISSING and is_writable(v)
+                                else None for v in values])
+        tag_parts = []
+        for key in sorted(self.tags):
+            prefix = escape_key(key)
+            tag_parts.append([prefix + escape_tag_value(v)
+                              if v is not MISSING and v is not None and
+                                 v != ""
+                              else None for v in self.tags[key]])
+
+        if self.timestamps is not None:
+            timestamps = [" %d" % format_timestamp(v, precision)
+                          if v is not MISSING and v else ""
+                          for v in column_values(self.timestamps)]
+        else:
+            timestamps = [""] * n
+
+        measurements = [escape_measurement(m) for m in self.measurements]
+
+        # transpose the columns back into rows in one go
+        field_rows = zip(*field_parts) if field_parts else [()] * n
+        tag_rows = zip(*tag_parts) if tag_parts else [()] * n
+
+        lines = []
+        for meas, fields, tags, timestamp in zip(measurements, field_rows,
+                                                 tag_rows, timestamps):
+            fields = [x for x in fields if x is not None]
+            if not fields:
+                lines.append(None)
+                continue
+            parts = [meas]
+            parts.extend([x for x in tags if x is not None])
+            lines.append("%s %s%s" % (",".join(parts), ",".join(fields),
+                                      timestamp))
+
+        return lines
+
+class InfluxBatchRow(object):
+    """A view of a single row of an InfluxBatch with the attributes of an
+       InfluxResult.  The tags and fields dicts are built on access, so
+       changing them does not change the batch."""
+    __slots__ = ('batch', 'index')
+
+    def __init__(self, batch, index):
+        self.batch = batch
+        self.index = index
+
+    @property
+    def measurement(self):
+        return self.batch.measurements[self.index]
+
+    @property
+    def tags(self):
+        return row_values(self.batch.tags, self.index)
+
+    @property
+    def fields(self):
+        return row_values(self.batch.fields, self.index)
+
+    @property
+    def timestamp(self):
+        if self.batch.timestamps is None:
+            return None
+        value = scalar(self.batch.timestamps[self.index])
+        if value is MISSING:
+            return None
+        return value
+
+    def to_result(self):
+        """Copy the row into an InfluxResult08"""
+        return InfluxResult08(self.measurement, tags=self.tags,
+                              timestamp=self.timestamp, fields=self.fields)
+
+    def to_dict(self):
+        return self.to_result().to_dict()
+
+    def to_line(self, precision='s'):
+        return self.to_result().to_line(precision)
+
+    def __repr__(self):
+        return repr(self.to_dict())
+
+def to_column(values):
+    """Convert a list of values to a NumPy array if they are all integers or
+       all floats, otherwise leave it as a list so the types are kept"""
+    kinds = set(type(v) for v in values)
+    if kinds <= set([int, long]):
+        try:
+            return np.array(values, dtype=np.int64)
+        except OverflowError:
+            return values
+    if kinds == set([float]):
+        return np.array(values, dtype=np.float64)
+    return values
+
+def column_values(col):
+    """Return a column as a list of Python values"""
+    if isinstance(col, np.ndarray):
+        return col.tolist()
+    return col
+
+def scalar(value):
+    """Convert a NumPy scalar to the equivalent Python value"""
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+def row_values(columns, index):
+    """Build a dict of the values of a row from a dict of columns"""
+    ret = {}
+    for key, col in columns.iteritems():
+        value = scalar(col[index])
+        if value is not MISSING:
+            ret[key] = value
+    return ret
+
+# vim: et:ai:sw=4:ts=4
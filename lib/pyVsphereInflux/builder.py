@@ -0,0 +1,165 @@
+"""Build InfluxResult objects from dicts of properties, with the tags and
+   fields of each kind of object compiled once into an extractor"""
+import threading
+
+from operator import itemgetter
+
+from pyVsphereInflux import InfluxResult08
+from pyVsphereInflux.tools.regex import measurement_name
+
+class RecordBuilder(object):
+    """Builds an InfluxResult08 per dict of properties for a fixed schema of
+       tags and fields.  An object missing any of them is dropped, and the
+       missing properties are counted rather than printed."""
+    def __init__(self, kind, tags, fields, coercions=None, name_key='name',
+                 select=None):
+        """
+            Arguments:
+                kind: the kind of object, eg. vm, for the summary
+                tags: a list of properties to use as Influx tags
+                fields: a list of properties to use as Influx fields, or
+                        None for every property that isn't a tag and for
+                        which select returns a value
+                coercions: a dict of property to a function converting its
+                           value
+                name_key: the property the measurement is named after
+                select: with fields None, a function returning the value to
+                        write of a property, or None to leave it out
+        """
+        self.kind = kind
+        self.tags = list(tags)
+        self.fields = list(fields) if fields is not None else None
+        self.name_key = name_key
+        self.select = select
+
+        coercions = coercions or {}
+        self.tag_coercions = [(i, tag, coercions[tag])
+                              for i, tag in enumerate(self.tags)
+                              if tag in coercions]
+        self.field_coercions = [(i, field, coercions[field])
+                                for i, field in enumerate(self.fields or [])
+                                if field in coercions]
+
+        # one itemgetter for every property, always returning a tuple of
+        # the name, then the tags, then the fields
+        self.keys = [name_key] + self.tags + (self.fields or [])
+        getter = itemgetter(*self.keys)
+        if len(self.keys) == 1:
+            self.get = lambda data: (getter(data),)
+        else:
+            self.get = getter
+        self.ntags = len(self.tags)
+
+        self.lock = threading.Lock()
+        self.dropped = 0
+        self.missing = {}
+
+    def build(self, data, measurement):
+        """Build an InfluxResult08 from a dict of properties
+            Arguments:
+                data: a dict of properties
+                measurement: the influx db measurement name the object's
+                             name is appended to
+            Results:
+                An InfluxResult08 object, or None if any property was
+                missing
+        """
+        try:
+            values = self.get(data)
+        except KeyError:
+            self._count_missing(data)
+            return None
+
+        ts = InfluxResult08(measurement_name(measurement, values[0]))
+        ts.tags = dict(zip(self.tags, values[1:self.ntags + 1]))
+        for i, tag, coerce in self.tag_coercions:
+            ts.tags[tag] = coerce(values[i + 1])
+
+        if self.fields is None:
+            for key, value in data.iteritems():
+                if key not in ts.tags:
+                    value = self.select(value)
+                    if value is not None:
+                        ts.fields[key] = value
+        else:
+            ts.fields = dict(zip(self.fields, values[self.ntags + 1:]))
+            for i, field, coerce in self.field_coercions:
+                ts.fields[field] = coerce(values[self.ntags + 1 + i])
+
+        return ts
+
+    def build_all(self, rows, measurement):
+        """Build an InfluxResult08 from each of a list of dicts of
+           properties, leaving out those missing any property"""
+        res = []
+        for data in rows:
+            ts = self.build(data, measurement)
+            if ts is not None:
+                res.append(ts)
+        return res
+
+    def _count_missing(self, data):
+        """Record the properties missing from a dropped object"""
+        with self.lock:
+            self.dropped += 1
+            for key in set(self.keys):
+                if key not in data:
+                    self.missing[key] = self.missing.get(key, 0) + 1
+
+    def summary(self, reset=False):
+        """Return a line summarizing the objects dropped, or None if none
+           were, eg. "vm: 2 dropped, missing guest.guestState (2)"
+            Arguments:
+                reset: start counting again, eg. for each collection cycle
+        """
+        with self.lock:
+            if not self.dropped:
+                return None
+            line = "%s: %d dropped, missing %s" % \
+                (self.kind, self.dropped,
+                 ", ".join("%s (%d)" % (key, self.missing[key])
+                           for key in sorted(self.missing)))
+            if reset:
+                self.dropped = 0
+                self.missing = {}
+        return line
+
+# compiled builders, shared between calls and threads
+_builders = {}
+_builders_lock = threading.Lock()
+
+def get_builder(kind, tags, fields, coercions=None, name_key='name',
+                select=None):
+    """Return the RecordBuilder for a schema, compiling it the first time.
+       Builders are keyed by every argument, so the same schema with
+       different coercions or select gets a builder of its own."""
+    key = (kind, tuple(tags), tuple(fields) if fields is not None else None,
+           tuple(sorted((coercions or {}).items())), name_key, select)
+    try:
+        return _builders[key]
+    except KeyError:
+        pass
+
+    with _builders_lock:
+        if key not in _builders:
+            _builders[key] = RecordBuilder(kind, tags, fields,
+                                           coercions=coercions,
+                                           name_key=name_key, select=select)
+        return _builders[key]
+
+def builder_summary(reset=False):
+    """Return a list of summary lines of every builder that dropped objects
+            Arguments:
+                reset: start counting again, eg. for each collection cycle
+    """
+    with _builders_lock:
+        builders = _builders.values()
+
+    lines = []
+    for builder in builders:
+        line = builder.summary(reset=reset)
+        if line is not None:
+            lines.append(line)
+    return sorted(lines)
+
+# vim: et:ai:sw=4:ts=4
@@ -0,0 +1,307 @@
+"""Capacity forecasting with linear regressions over many series at once"""
+import os
+import json
+import time
+import itertools
+
+import numpy as np
+
+def stack_series(columns):
+    """Stack series of different lengths into a padded 2-d array
+            Arguments:
+                columns: a list of sequences of numbers, None for a missing
+                         value
+            Results:
+                A (values, mask) tuple of 2-d NumPy arrays with a row per
+                series, mask being True where values holds a real value
+    """
+    lengths = np.array([len(x) for x in columns], dtype=np.intp)
+    width = lengths.max() if len(lengths) else 0
+
+    # convert everything in one go rather than a series at a time
+    if columns and all(isinstance(x, np.ndarray) for x in columns):
+        flat = np.concatenate(columns).astype(np.float64)
+    else:
+        flat = np.array(list(itertools.chain.from_iterable(columns)),
+                        dtype=np.float64)
+
+    # the row and column of each value in the padded array
+    rows = np.repeat(np.arange(len(columns)), lengths)
+    starts = np.cumsum(lengths) - lengths
+    cols = np.arange(len(flat)) - np.repeat(starts, lengths)
+
+    values = np.zeros((len(columns), width), dtype=np.float64)
+    mask = np.zeros((len(columns), width), dtype=bool)
+    values[rows, cols] = flat
+    mask[rows, cols] = ~np.isnan(flat)
+
+    # padding and missing values must not contribute to any sums
+    values[~mask] = 0.0
+    return values, mask
+
+def fit_linear(x, y, mask):
+    """Fit y = slope * x + intercept to every row of x and y at once.  x is
+       centred on its mean before fitting, which keeps the sums small for
+       epoch timestamps.
+            Arguments:
+                x, y, mask: 2-d arrays as from stack_series, with y only
+                            valid where both x and y are
+            Results:
+                A (slope, intercept, x_mean, y_mean) tuple of 1-d arrays.
+                Rows with fewer than two distinct x values get a NaN slope
+                and intercept.
+    """
+    m = mask.astype(np.float64)
+    n = m.sum(axis=1)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        x_mean = (x * m).sum(axis=1) / n
+        y_mean = (y * m).sum(axis=1) / n
+
+        xc = (x - x_mean[:, np.newaxis]) * m
+        yc = (y - y_mean[:, np.newaxis]) * m
+        sxx = (xc * xc).sum(axis=1)
+        sxy = (xc * yc).sum(axis=1)
+
+        slope = sxy / sxx
+        slope[sxx == 0] = np.nan
+        intercept = y_mean - slope * x_mean
+
+    return slope, intercept, x_mean, y_mean
+
+def solve_for_x(target, slope, x_mean, y_mean):
+    """Return the x at which each fitted line reaches target, computed
+       relative to the centre of the fit for precision.  A flat line never
+       gets there, which is reported as inf."""
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return x_mean + (target - y_mean) / slope
+
+def last_values(values, mask):
+    """Return the last valid value of each row, NaN for an empty row"""
+    width = mask.shape[1]
+    if width == 0:
+        return np.full(mask.shape[0], np.nan)
+
+    last = width - 1 - np.argmax(mask[:, ::-1], axis=1)
+    ret = values[np.arange(len(values)), last]
+    ret[~mask.any(axis=1)] = np.nan
+    return ret
+
+def forecast(names, times, used, capacity, now=None):
+    """Forecast when each series reaches 90% and 100% of its capacity, all
+       series being fitted in one vectorized pass
+            Arguments:
+                names: a list of series names
+                times: a list of sequences of timestamps in seconds, one
+                       per series
+                used: a list of sequences of used capacity, one per series
+                capacity: a list of sequences of total capacity, one per
+                          series
+                now: the time to count from, default now
+            Results:
+                A dict of series name to a dict of:
+                    slope, intercept: the fitted line of used over time
+                    latest_used, latest_capacity, latest_remaining,
+                    percent_used: the latest values
+                    full_ts, ninety_full_ts: the timestamps at which used
+                                             reaches 100% and 90%
+                    secs_until_full, secs_until_ninety_full,
+                    days_until_full, days_until_ninety_full: the time left
+                                                            until then
+    """
+    if now is None:
+        now = time.time()
+
+    x, x_mask = stack_series(times)
+    y, y_mask = stack_series(used)
+    cap, cap_mask = stack_series(capacity)
+    mask = x_mask & y_mask
+
+    slope, intercept, x_mean, y_mean = fit_linear(x, y, mask)
+
+    return forecast_fits(names, slope, intercept, x_mean, y_mean,
+                         last_values(y, y_mask), last_values(cap, cap_mask),
+                         now)
+
+def forecast_fits(names, slope, intercept, x_mean, y_mean, latest_used,
+                  latest_cap, now):
+    """Work out the statistics returned by forecast from fitted lines and
+       the latest values, all being 1-d arrays with an entry per series"""
+    full_ts = solve_for_x(latest_cap, slope, x_mean, y_mean)
+    ninety_full_ts = solve_for_x(latest_cap * 0.9, slope, x_mean, y_mean)
+
+    stats = {}
+    stats['slope'] = slope
+    stats['intercept'] = intercept
+    stats['latest_used'] = latest_used
+    stats['latest_capacity'] = latest_cap
+    stats['latest_remaining'] = latest_cap - latest_used
+    with np.errstate(invalid='ignore', divide='ignore'):
+        stats['percent_used'] = latest_used / latest_cap * 100
+    stats['full_ts'] = full_ts
+    stats['secs_until_full'] = full_ts - now
+    stats['days_until_full'] = stats['secs_until_full'] / 86400
+    stats['ninety_full_ts'] = ninety_full_ts
+    stats['secs_until_ninety_full'] = ninety_full_ts - now
+    stats['days_until_ninety_full'] = stats['secs_until_ninety_full'] / 86400
+
+    # back to a dict per series of plain floats
+    columns = [(key, stats[key].tolist()) for key in stats]
+    ret = {}
+    for i, name in enumerate(names):
+        ret[name] = dict((key, values[i]) for key, values in columns)
+
+    return ret
+
+class RegressionState(object):
+    """The running sums of a linear fit of used capacity over time for one
+       series, kept between runs so that each run only has to add the
+       buckets that are new since the last.  x is kept in days from origin,
+       which keeps the sums small.  The buckets themselves are kept too, so
+       that they can be taken out of the sums again as they fall out of the
+       window.
+    """
+    def __init__(self, origin, n=0, sx=0.0, sy=0.0, sxx=0.0, sxy=0.0,
+                 watermark=None, buckets=None, latest=None):
+        """
+            Arguments:
+                origin: the timestamp x is counted from
+                n, sx, sy, sxx, sxy: the count and sums of x, y, x*x, x*y
+                watermark: the timestamp of the last bucket added
+                buckets: a list of [timestamp, used] in the sums
+                latest: [timestamp, used, capacity] of the last bucket added
+        """
+        self.origin = origin
+        self.n = n
+        self.sx = sx
+        self.sy = sy
+        self.sxx = sxx
+        self.sxy = sxy
+        self.watermark = watermark
+        self.buckets = buckets if buckets is not None else []
+        self.latest = latest
+
+    def add(self, timestamp, used, capacity):
+        """Add a complete bucket, which must be newer than the watermark"""
+        if self.watermark is not None and timestamp <= self.watermark:
+            return
+        self._update(timestamp, used, 1)
+        self.buckets.append([timestamp, used])
+        self.watermark = timestamp
+        self.latest = [timestamp, used, capacity]
+
+    def expire(self, before):
+        """Take the buckets older than before out of the sums.  Once every
+           bucket has expired the state starts again, forgetting the latest
+           values and the watermark so that any bucket in the new window is
+           added.  Until then the latest bucket, being the newest, is still
+           in the window."""
+        i = 0
+        while i < len(self.buckets) and self.buckets[i][0] <= before:
+            self._update(self.buckets[i][0], self.buckets[i][1], -1)
+            i += 1
+        del self.buckets[:i]
+
+        if not self.buckets:
+            # start again from exact zeros rather than accumulated error
+            self.n = 0
+            self.sx = self.sy = self.sxx = self.sxy = 0.0
+            self.watermark = None
+            self.latest = None
+
+    def _update(self, timestamp, used, sign):
+        if used is None:
+            return
+        x = (timestamp - self.origin) / 86400.0
+        self.n += sign
+        self.sx += sign * x
+        self.sy += sign * used
+        self.sxx += sign * x * x
+        self.sxy += sign * x * used
+
+    def copy(self):
+        return RegressionState(self.origin, self.n, self.sx, self.sy,
+                               self.sxx, self.sxy, self.watermark,
+                               list(self.buckets), self.latest)
+
+    def to_dict(self):
+        return {'origin': self.origin, 'n': self.n, 'sx': self.sx,
+                'sy': self.sy, 'sxx': self.sxx, 'sxy': self.sxy,
+                'watermark': self.watermark, 'buckets': self.buckets,
+                'latest': self.latest}
+
+    @staticmethod
+    def from_dict(d):
+        return RegressionState(d['origin'], d['n'], d['sx'], d['sy'],
+                               d['sxx'], d['sxy'], d['watermark'],
+                               d['buckets'], d['latest'])
+
+def forecast_states(names, states, now=None):
+    """Forecast as forecast, from a RegressionState per series
+            Arguments:
+                names: a list of series names
+                states: a list of RegressionState objects, one per series
+                now: the time to count from, default now
+            Results:
+                As forecast
+    """
+    if now is None:
+        now = time.time()
+
+    def column(attr):
+        return np.array([getattr(s, attr) for s in states], dtype=np.float64)
+
+    n = column('n')
+    origin = column('origin')
+    latest = [s.latest or [None, None, None] for s in states]
+    latest_used = np.array([x[1] for x in latest], dtype=np.float64)
+    latest_cap = np.array([x[2] for x in latest], dtype=np.float64)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        x_mean = column('sx') / n
+        y_mean = column('sy') / n
+        sxx = column('sxx') - n * x_mean * x_mean
+        sxy = column('sxy') - n * x_mean * y_mean
+
+        # per day from origin to per second from the epoch
+        slope = sxy / sxx / 86400
+        slope[~(sxx > 0)] = np.nan
+        x_mean = origin + x_mean * 86400
+        intercept = y_mean - slope * x_mean
+
+    return forecast_fits(names, slope, intercept, x_mean, y_mean,
+                         latest_used, latest_cap, now)
+
+def load_states(path, interval):
+    """Load the RegressionState objects saved by save_states
+            Arguments:
+                path: the file they were saved to
+                interval: the bucket interval in seconds.  States saved
+                          with a different interval are not loaded.
+            Results:
+                A dict of series name to RegressionState
+    """
+    try:
+        with open(path) as f:
+            saved = json.load(f)
+    except (IOError, ValueError):
+        return {}
+
+    if saved.get('interval') != interval:
+        return {}
+
+    return dict((name, RegressionState.from_dict(d))
+                for name, d in saved['series'].iteritems())
+
+def save_states(path, states, interval):
+    """Save a dict of series name to RegressionState to a file, atomically"""
+    saved = {'interval': interval,
+             'series': dict((name, state.to_dict())
+                            for name, state in states.iteritems())}
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(saved, f)
+    os.rename(tmp_path, path)
+
+# vim: et:ai:sw=4:ts=4
@@ -0,0 +1,115 @@
+"""Columnar parsing of InfluxDB 0.8 query results"""
+import numpy as np
+
+from pyVsphereInflux import InfluxResult08
+
+class SeriesFrame(object):
+    """The points of a single series from a query, as columns.  time is a
+       NumPy array of timestamps (or None if the query returned no time
+       column), and data maps each other column name to a NumPy array when
+       its values are all numeric, otherwise to a list.
+    """
+    def __init__(self, name, time=None, data=None, columns=None):
+        """
+            Arguments:
+                name: the series name
+                time: the column of timestamps
+                data: a dict of column name to column
+                columns: the column names in query order, default the keys
+                         of data
+        """
+        self.name = name
+        self.time = time
+        self.data = data or {}
+        self.columns = columns or list(self.data)
+
+    def __len__(self):
+        if self.time is not None:
+            return len(self.time)
+        for column in self.columns:
+            return len(self.data[column])
+        return 0
+
+    def __getitem__(self, column):
+        return self.data[column]
+
+    def floats(self, column):
+        """Return a column as a float array, with NaN for missing (None)
+           values, or all NaN if the query didn't return the column"""
+        if column not in self.data:
+            return np.full(len(self), np.nan)
+        return np.array(self.data[column], dtype=np.float64)
+
+    def to_results(self):
+        """Convert to a list of InfluxResult08 objects as from_query"""
+        if self.time is not None:
+            timestamps = self.time.tolist()
+        else:
+            timestamps = [None] * len(self)
+        columns = [(c, column_list(self.data[c])) for c in self.columns]
+
+        ret = []
+        for i, timestamp in enumerate(timestamps):
+            ts = InfluxResult08(self.name, timestamp=timestamp)
+            for column, values in columns:
+                ts.fields[column] = values[i]
+            ret.append(ts)
+
+        return ret
+
+def empty_frame(name):
+    """Return a SeriesFrame without any points"""
+    return SeriesFrame(name, time=np.zeros(0, dtype=np.int64))
+
+def query_frames(client, query):
+    """Query InfluxDB using the client and return a dict of SeriesFrame
+       objects a la frames_from_query"""
+    return frames_from_query(client.query(query))
+
+def frames_from_query(query_res):
+    """Create SeriesFrame objects from the return value of
+       InfluxDBClient.query().  The column positions are found once per
+       series and each column is converted as a whole.
+            Results:
+                A dict of series name to SeriesFrame
+    """
+    ret = {}
+    for series in query_res:
+        points = series['points']
+
+        # transpose the rows into columns in one go
+        if points:
+            values = zip(*points)
+        else:
+            values = [()] * len(series['columns'])
+
+        time = None
+        data = {}
+        columns = []
+        for column, column_values in zip(series['columns'], values):
+            if column == 'time':
+                time = np.array(column_values, dtype=np.int64)
+            elif column != 'sequence_number':
+                data[column] = to_array(column_values)
+                columns.append(column)
+
+        ret[series['name']] = SeriesFrame(series['name'], time=time,
+                                          data=data, columns=columns)
+
+    return ret
+
+def to_array(values):
+    """Convert a column to a NumPy array if it is all numbers, otherwise to a
+       list.  Columns with missing values (None) stay lists."""
+    arr = np.array(values)
+    if arr.dtype.kind in 'iuf':
+        return arr
+    return list(values)
+
+def column_list(col):
+    """Return a column as a list of Python values"""
+    if isinstance(col, np.ndarray):
+        return col.tolist()
+    return col
+
+# vim: et:ai:sw=4:ts=4
@@ -0,0 +1,201 @@
+"""Collect vSphere performance counters with batched QueryPerf calls"""
+import os
+import json
+import calendar
+
+from multiprocessing.pool import ThreadPool
+
+from pyVmomi import vim
+from pyVsphereInflux import InfluxResult08
+from pyVsphereInflux.tools import pchelper
+from pyVsphereInflux.tools.regex import measurement_name
+
+# the realtime interval, 20 second samples kept for an hour
+REALTIME_INTERVAL = 20
+
+class CounterCatalog(object):
+    """The ids of the performance counters of a vCenter by name, eg.
+       cpu.usage.average.  Counter ids differ between vCenters but not over
+       time, so the catalog is cached on disk keyed by the instance UUID of
+       the vCenter."""
+    def __init__(self, service_instance, cache_dir=None):
+        """
+            Arguments:
+                service_instance: a service instance as returned from
+                                  pyVim.connect.SmartConnect
+                cache_dir: the directory to cache catalogs in, or None to
+                           always read the catalog from the vCenter
+        """
+        self.uuid = service_instance.content.about.instanceUuid
+        self.perf_manager = service_instance.content.perfManager
+        self.cache_dir = cache_dir
+        self.counters = None
+        # whether the counters came from the cache, and so could be missing
+        # counters added to the vCenter since
+        self.cached = False
+
+        self.path = None
+        if cache_dir is not None:
+            self.path = os.path.join(cache_dir, "%s.json" % self.uuid)
+            try:
+                with open(self.path) as f:
+                    self.counters = dict((str(k), v) for k, v in
+                                         json.load(f).iteritems())
+                self.cached = True
+            except (IOError, ValueError):
+                pass
+
+        if self.counters is None:
+            self.load()
+        else:
+            self.names = dict((v, k) for k, v in self.counters.iteritems())
+
+    def load(self):
+        """Read the catalog from the vCenter, replacing the cached one"""
+        self.counters = {}
+        for counter in self.perf_manager.perfCounter:
+            name = "%s.%s.%s" % (counter.groupInfo.key,
+                                 counter.nameInfo.key,
+                                 counter.rollupType)
+            self.counters[name] = counter.key
+        self.names = dict((v, k) for k, v in self.counters.iteritems())
+        self.cached = False
+
+        if self.path is not None:
+            if not os.path.isdir(self.cache_dir):
+                os.makedirs(self.cache_dir)
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(self.counters, f)
+            os.rename(tmp_path, self.path)
+
+    def ids(self, names):
+        """Return the ids of a list of counter names, raising KeyError for
+           an unknown counter.  A cached catalog is read from the vCenter
+           again once before a counter is reported as unknown."""
+        missing = [name for name in names if name not in self.counters]
+        if missing and self.cached:
+            self.load()
+            missing = [name for name in names if name not in self.counters]
+        if missing:
+            raise KeyError("unknown performance counter %s" % missing[0])
+
+        return [self.counters[name] for name in names]
+
+def build_query_specs(entities, counter_ids, batch_size=50, max_sample=1,
+                      interval_id=REALTIME_INTERVAL):
+    """Build QuerySpecs for the given counters of every entity, grouped into
+       batches for a QueryPerf call each
+            Arguments:
+                entities: a list of managed objects, eg. vim.VirtualMachine
+                counter_ids: a list of counter ids
+                batch_size: the number of entities per QueryPerf call
+                max_sample: the number of most recent samples to get
+                interval_id: the sampling interval in seconds
+            Results:
+                A list of lists of vim.PerformanceManager.QuerySpec
+    """
+    metric_ids = [vim.PerformanceManager.MetricId(counterId=counter_id,
+                                                  instance="")
+                  for counter_id in counter_ids]
+
+    specs = [vim.PerformanceManager.QuerySpec(entity=entity,
+                                              metricId=metric_ids,
+                                              intervalId=interval_id,
+                                              maxSample=max_sample)
+             for entity in entities]
+
+    return [specs[i:i + batch_size] for i in range(0, len(specs), batch_size)]
+
+def collect_perf(service_instance, entities, counters, measurement='vmperf',
+                 batch_size=50, workers=4, max_sample=1, catalog=None):
+    """Build a list of InfluxResult objects of performance counter samples
+            Arguments:
+                service_instance: a service instance as returned from
+                                  pyVim.connect.SmartConnect
+                entities: a dict of managed object to its name
+                counters: a list of counter names, eg. cpu.usage.average
+                measurement: the influx db measurement name to use
+                batch_size: the number of entities per QueryPerf call
+                workers: the number of QueryPerf calls to make at once
+                max_sample: the number of most recent samples to get
+                catalog: a CounterCatalog, default one read from the vCenter
+            Results:
+                A list of InfluxResult objects suitable to insert into a
+                database, one per entity and sample, timestamped with the
+                time of the sample
+    """
+    if catalog is None:
+        catalog = CounterCatalog(service_instance)
+    perf_manager = service_instance.content.perfManager
+
+    batches = build_query_specs(entities.keys(), catalog.ids(counters),
+                                batch_size=batch_size, max_sample=max_sample)
+
+    def query(batch):
+        return perf_manager.QueryPerf(querySpec=batch) or []
+
+    if workers > 1 and len(batches) > 1:
+        pool = ThreadPool(workers)
+        try:
+            metrics = pool.map(query, batches)
+        finally:
+            pool.close()
+    else:
+        metrics = [query(batch) for batch in batches]
+
+    # the entities come back as new objects, so match them up by id
+    names = dict((entity._moId, name) for entity, name in entities.items())
+    res = []
+    for batch_metrics in metrics:
+        for entity_metric in batch_metrics:
+            name = names.get(entity_metric.entity._moId)
+            if name is None:
+                continue
+            res.extend(metric_to_results(entity_metric, name, catalog,
+                                         measurement))
+
+    return res
+
+def metric_to_results(entity_metric, name, catalog, measurement):
+    """Build an InfluxResult object per sample of a
+       vim.PerformanceManager.EntityMetric"""
+    meas = measurement_name(measurement, name)
+    res = []
+    for i, sample in enumerate(entity_metric.sampleInfo):
+        ts = InfluxResult08(meas)
+        ts.timestamp = calendar.timegm(sample.timestamp.utctimetuple())
+        ts.tags['name'] = name
+        for series in entity_metric.value:
+            if i < len(series.value):
+                ts.fields[catalog.names[series.id.counterId]] = \
+                    series.value[i]
+        if ts.fields:
+            res.append(ts)
+
+    return res
+
+def get_powered_on_vms(service_instance, page_size=None):
+    """Return a dict of every powered on vm, which are the only ones with
+       realtime statistics, to its name
+            Arguments:
+                service_instance: a service instance as returned from
+                                  pyVim.connect.SmartConnect
+                page_size: the maximum number of vms per PropertyCollector
+                           page
+    """
+    view = pchelper.get_container_view(service_instance,
+                                       obj_type=[vim.VirtualMachine])
+    try:
+        vms = pchelper.iter_properties(service_instance, view_ref=view,
+                                       obj_type=vim.VirtualMachine,
+                                       path_set=['name',
+                                                 'runtime.powerState'],
+                                       include_mors=True,
+                                       max_objects=page_size)
+        return dict((vm['obj'], vm['name']) for vm in vms
+                    if vm.get('runtime.powerState') == 'poweredOn')
+    finally:
+        view.Destroy()
+
+# vim: et:ai:sw=4:ts=4
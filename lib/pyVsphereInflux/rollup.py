@@ -0,0 +1,345 @@
+"""Aggregate results into any number of rollup levels in a single pass"""
+import re
+
+import numpy as np
+
+from pyVsphereInflux import InfluxResult08
+from pyVsphereInflux.batch import InfluxBatch, MISSING, column_values
+from pyVsphereInflux.tools.regex import series_keys
+
+NUMERIC_TYPES = (int, long, float)
+ACCUMULATORS = ('sum', 'count', 'min', 'max', 'mean')
+
+# folderN is the folder path down to depth N
+FOLDER_KEY = re.compile(r"^folder(\d+)$")
+
+def folder_at_depth(folder_path, depth):
+    """Return the first depth folders of a folder path such as /a/b/c, or
+       "None" for the root folder"""
+    parts = folder_path.split('/')[1:]
+    if not parts:
+        return "None"
+    return "/".join(parts[:depth])
+
+class RollupLevel(object):
+    """A level to aggregate results into, one aggregate per distinct
+       combination of the values of its keys.  Each key is a tag or field
+       name, or folderN for the folderPath tag down to depth N.  The
+       aggregate of the key values a, b is named measurement.a.b and tagged
+       with the key values.
+    """
+    def __init__(self, measurement, keys, accumulator='sum'):
+        """
+            Arguments:
+                measurement: the base measurement name of the aggregates
+                keys: a list of key names
+                accumulator: how to combine fields, one of:
+                    sum: add up numeric fields, keeping the first value of
+                         any other field
+                    count: count the results with each field
+                    min, max, mean: of numeric fields, keeping the first
+                                    value of any other field
+        """
+        if accumulator not in ACCUMULATORS:
+            raise ValueError("unknown accumulator %s" % accumulator)
+
+        self.measurement = measurement
+        self.keys = keys
+        self.accumulator = accumulator
+
+        # (key name, source name, depth or None)
+        self.sources = []
+        for key in keys:
+            match = FOLDER_KEY.match(key)
+            if match:
+                self.sources.append((key, 'folderPath', int(match.group(1))))
+            else:
+                self.sources.append((key, key, None))
+
+    @staticmethod
+    def parse(spec):
+        """Parse a level from a string like measurement:key,key[:accumulator]
+           such as vmagg_guestState:vcenter,guest.guestState:count"""
+        parts = spec.split(':')
+        if len(parts) not in (2, 3) or not parts[0] or not parts[1]:
+            raise ValueError("invalid rollup level %s" % spec)
+        if len(parts) == 3:
+            return RollupLevel(parts[0], parts[1].split(','), parts[2])
+        return RollupLevel(parts[0], parts[1].split(','))
+
+    def key_values(self, ts):
+        """Return the key values of a result, or None if it lacks a key"""
+        values = []
+        for key, source, depth in self.sources:
+            if source in ts.tags:
+                value = ts.tags[source]
+            elif source in ts.fields:
+                value = ts.fields[source]
+            else:
+                return None
+            if depth is not None:
+                value = folder_at_depth(value, depth)
+            values.append(value)
+        return values
+
+    def key_codes(self, batch):
+        """Factorize the key values of a batch, see factorize
+            Results:
+                A (codes, uniques) tuple: a 2-d NumPy array with a row of
+                codes per key and a column per row of the batch, and per
+                key the list of distinct values the codes index.  MISSING
+                is one of the values of a key some rows lack.
+        """
+        codes = np.zeros((len(self.sources), len(batch)), dtype=np.intp)
+        uniques = []
+        for k, (key, source, depth) in enumerate(self.sources):
+            if source in batch.tags:
+                codes[k], values = factorize(batch.tags[source])
+            elif source in batch.fields:
+                codes[k], values = factorize(batch.fields[source])
+            else:
+                # codes are already all 0
+                values = [MISSING]
+
+            if depth is not None:
+                # only the distinct paths need cutting down, after which
+                # some of them may be the same
+                values = [folder_at_depth(v, depth) if v is not MISSING
+                          else MISSING for v in values]
+                folder_codes, values = factorize(values)
+                codes[k] = folder_codes[codes[k]]
+            uniques.append(values)
+
+        return codes, uniques
+
+def factorize(column):
+    """Number the distinct values of a column, sorting them in C rather
+       than looking each row up in a dict
+            Arguments:
+                column: a list or NumPy array
+            Results:
+                A (codes, uniques) tuple of a NumPy array with the index in
+                uniques of the value of each row, and a list of the
+                distinct values
+    """
+    if not isinstance(column, np.ndarray):
+        values = np.empty(len(column), dtype=object)
+        values[:] = column
+        column = values
+
+    try:
+        uniques, codes = np.unique(column, return_inverse=True)
+    except (TypeError, UnicodeDecodeError):
+        # values that can't be sorted together, eg. non-ascii str and
+        # unicode
+        index = {}
+        codes = np.array([index.setdefault(v, len(index)) for v in column],
+                         dtype=np.intp)
+        return codes, sorted(index, key=index.get)
+    return codes, uniques.tolist()
+
+class Rollup(object):
+    """Aggregate results into every level at once as they are added"""
+    def __init__(self, levels):
+        """
+            Arguments:
+                levels: a list of RollupLevel objects
+        """
+        self.levels = levels
+        # per level, the aggregates keyed by measurement name in the order
+        # they were created
+        self.groups = [{} for level in levels]
+        self.order = [[] for level in levels]
+        # per level and field, the number of values in each mean
+        self.counts = [{} for level in levels]
+
+    def measurement(self, level, values):
+        """Return the measurement name of an aggregate from its key values"""
+        return series_keys.measurement(level.measurement, tuple(values))
+
+    def add(self, ts):
+        """Add a result to every level"""
+        for i, level in enumerate(self.levels):
+            values = level.key_values(ts)
+            if values is None:
+                continue
+            meas = self.measurement(level, values)
+
+            agg = self.groups[i].get(meas)
+            if agg is None:
+                agg = InfluxResult08(meas, timestamp=ts.timestamp)
+                for key, value in zip(level.keys, values):
+                    agg.tags[key] = value
+                self.groups[i][meas] = agg
+                self.order[i].append(agg)
+                self.counts[i][meas] = {}
+            accumulate(agg.fields, self.counts[i][meas], ts.fields,
+                       level.accumulator)
+
+    def add_all(self, results):
+        """Add every result of a list or an InfluxBatch"""
+        if isinstance(results, InfluxBatch):
+            self.add_batch(results)
+        else:
+            for ts in results:
+                self.add(ts)
+
+    def add_batch(self, batch):
+        """Add every row of an InfluxBatch, grouping the rows with NumPy and
+           aggregating each field column of a group at once"""
+        timestamps = None
+        if batch.timestamps is not None:
+            timestamps = column_values(batch.timestamps)
+
+        for i, level in enumerate(self.levels):
+            for meas, values, indices in self.group_rows(level, batch):
+                agg = self.groups[i].get(meas)
+                if agg is None:
+                    timestamp = None
+                    if timestamps is not None and \
+                       timestamps[indices[0]] is not MISSING:
+                        timestamp = timestamps[indices[0]]
+                    agg = InfluxResult08(meas, timestamp=timestamp)
+                    for key, value in zip(level.keys, values):
+                        agg.tags[key] = value
+                    self.groups[i][meas] = agg
+                    self.order[i].append(agg)
+                    self.counts[i][meas] = {}
+                accumulate_columns(agg.fields, self.counts[i][meas],
+                                   batch.fields, indices, level.accumulator)
+
+    def group_rows(self, level, batch):
+        """Group the rows of a batch by measurement name for a level
+            Results:
+                A list of (measurement, key values, row indices) tuples in
+                the order of the first row of each, leaving out the rows
+                missing a key
+        """
+        if len(batch) == 0:
+            return []
+
+        codes, uniques = level.key_codes(batch)
+
+        # a single group number per combination of codes
+        valid = np.ones(len(batch), dtype=bool)
+        group = np.zeros(len(batch), dtype=np.int64)
+        for k, values in enumerate(uniques):
+            for code, value in enumerate(values):
+                if value is MISSING:
+                    valid &= codes[k] != code
+            group = group * len(values) + codes[k]
+            # renumber to keep the numbers small
+            group = np.unique(group, return_inverse=True)[1]
+
+        rows = np.flatnonzero(valid)
+        groups, first, inverse = np.unique(group[rows], return_index=True,
+                                           return_inverse=True)
+        # the rows of each group, in order
+        order = np.argsort(inverse, kind='mergesort')
+        bounds = np.cumsum(np.bincount(inverse, minlength=len(groups)))
+        members = np.split(rows[order], bounds[:-1])
+
+        # different key values can still sanitize to the same name
+        ret = []
+        by_meas = {}
+        for g in np.argsort(first, kind='mergesort'):
+            row = rows[first[g]]
+            values = [uniques[k][codes[k][row]] for k in range(len(uniques))]
+            meas = self.measurement(level, values)
+            if meas in by_meas:
+                entry = by_meas[meas]
+                entry[2] = np.sort(np.concatenate((entry[2], members[g])))
+            else:
+                by_meas[meas] = [meas, values, members[g]]
+                ret.append(by_meas[meas])
+
+        return [tuple(entry) for entry in ret]
+
+    def results(self):
+        """Return the aggregates of every level as a list of InfluxResult08
+           objects"""
+        ret = []
+        for i, level in enumerate(self.levels):
+            for agg in self.order[i]:
+                if level.accumulator == 'mean':
+                    counts = self.counts[i][agg.measurement]
+                    agg = InfluxResult08(agg.measurement, tags=agg.tags,
+                                         timestamp=agg.timestamp,
+                                         fields=dict(agg.fields))
+                    for field in counts:
+                        agg.fields[field] = \
+                            float(agg.fields[field]) / counts[field]
+                ret.append(agg)
+        return ret
+
+def accumulate(agg_fields, counts, fields, accumulator):
+    """Fold the fields of a result into the fields of an aggregate.
+       counts records the number of values in each numeric field for
+       means.  None values are only counted, since they can't be added or
+       compared with numbers."""
+    for field, value in fields.iteritems():
+        if accumulator == 'count':
+            agg_fields[field] = agg_fields.get(field, 0) + 1
+        elif value is None:
+            continue
+        elif field not in agg_fields:
+            agg_fields[field] = value
+            if accumulator == 'mean' and type(value) in NUMERIC_TYPES:
+                counts[field] = 1
+        elif type(agg_fields[field]) in NUMERIC_TYPES:
+            if accumulator in ('sum', 'mean'):
+                agg_fields[field] += value
+                if accumulator == 'mean':
+                    counts[field] += 1
+            elif accumulator == 'min':
+                agg_fields[field] = min(agg_fields[field], value)
+            elif accumulator == 'max':
+                agg_fields[field] = max(agg_fields[field], value)
+
+def accumulate_columns(agg_fields, counts, columns, indices, accumulator):
+    """Fold some rows of a dict of field columns into the fields of an
+       aggregate as accumulate, reducing NumPy columns with NumPy"""
+    for field, column in columns.iteritems():
+        if not isinstance(column, np.ndarray):
+            # a column of mixed types or with missing values, which are
+            # masked before anything is reduced
+            for row in indices:
+                if column[row] is not MISSING:
+                    accumulate(agg_fields, counts, {field: column[row]},
+                               accumulator)
+            continue
+
+        values = column[indices]
+        if accumulator == 'count':
+            agg_fields[field] = agg_fields.get(field, 0) + len(values)
+            continue
+        if accumulator in ('sum', 'mean'):
+            value = values.sum().item()
+        elif accumulator == 'min':
+            value = values.min().item()
+        else:
+            value = values.max().item()
+
+        if field not in agg_fields:
+            agg_fields[field] = value
+            if accumulator == 'mean':
+                counts[field] = len(values)
+        elif type(agg_fields[field]) in NUMERIC_TYPES:
+            accumulate(agg_fields, counts, {field: value}, accumulator)
+            if accumulator == 'mean':
+                counts[field] += len(values) - 1
+
+def rollup(results, levels):
+    """Aggregate a list of results or an InfluxBatch into every level in a
+       single pass
+            Arguments:
+                results: a list of InfluxResult objects or an InfluxBatch
+                levels: a list of RollupLevel objects
+            Results:
+                A list of InfluxResult08 aggregates
+    """
+    engine = Rollup(levels)
+    engine.add_all(results)
+    return engine.results()
+
+# vim: et:ai:sw=4:ts=4
@@ -0,0 +1,219 @@
+"""Disk-backed spool of points for when InfluxDB is slow or down"""
+import os
+import json
+import time
+import fcntl
+
+from contextlib import contextmanager
+
+from pyVsphereInflux import InfluxResult08
+
+SEGMENT_SUFFIX = ".spool"
+OFFSET_SUFFIX = ".offset"
+
+class Spool(object):
+    """An append-only spool of points in numbered segment files.  Points are
+       appended with their collection timestamp, and drained in order to a
+       writer from pyVsphereInflux.influx, so a write that fails is retried
+       on a later drain instead of being lost.
+
+       Appending and draining take an exclusive flock on the directory, so
+       the spool can be shared by threads and by overlapping runs of the
+       import script.
+    """
+    def __init__(self, directory, segment_bytes=16 * 2**20,
+                 max_bytes=1024 * 2**20, max_age=7 * 86400):
+        """
+            Arguments:
+                directory: the directory to keep the segments in
+                segment_bytes: start a new segment after this many bytes
+                max_bytes: evict the oldest segments beyond this many bytes
+                max_age: evict segments last written more than this many
+                         seconds ago
+        """
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    @contextmanager
+    def locked(self):
+        """Hold the lock on the spool directory"""
+        fd = os.open(self.directory, os.O_RDONLY)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            # closing releases the lock
+            os.close(fd)
+
+    def segments(self):
+        """Return the paths of the segments, oldest first"""
+        names = [x for x in os.listdir(self.directory)
+                 if x.endswith(SEGMENT_SUFFIX)]
+        return [os.path.join(self.directory, x) for x in sorted(names)]
+
+    def append(self, results, timestamp=None):
+        """Append results to the newest segment
+                Arguments:
+                    results: a list of InfluxResult objects
+                    timestamp: the collection time in seconds for results
+                               without a timestamp, default now
+        """
+        if timestamp is None:
+            timestamp = int(time.time())
+
+        lines = []
+        for ts in results:
+            rec = {'measurement': ts.measurement,
+                   'tags': ts.tags,
+                   'fields': ts.fields,
+                   'timestamp': ts.timestamp or timestamp}
+            lines.append(json.dumps(rec) + "\n")
+
+        with self.locked():
+            segments = self.segments()
+            if segments and os.path.getsize(segments[-1]) < self.segment_bytes:
+                path = segments[-1]
+            elif segments:
+                path = self._segment_path(self._segment_number(segments[-1]) + 1)
+            else:
+                path = self._segment_path(0)
+
+            # end a partial line left by an append that died, so that it is
+            # skipped as a bad record rather than merged with the first one
+            if os.path.exists(path) and os.path.getsize(path) > 0:
+                with open(path, 'rb') as f:
+                    f.seek(-1, os.SEEK_END)
+                    if f.read(1) != "\n":
+                        lines.insert(0, "\n")
+
+            with open(path, 'a') as f:
+                f.writelines(lines)
+                f.flush()
+                os.fsync(f.fileno())
+
+            self._evict()
+
+    def drain(self, writer, max_attempts=3, backoff=1.0, max_backoff=60.0):
+        """Write the spooled points in order, a batch at a time, retrying a
+           failed batch with exponential backoff
+                Arguments:
+                    writer: an InfluxWriter
+                    max_attempts: give up on this drain after a batch has
+                                  failed this many times
+                    backoff: seconds to wait after the first failure,
+                             doubled after each one
+                    max_backoff: the longest wait between attempts
+                Results:
+                    True if the spool is now empty
+        """
+        with self.locked():
+            segments = self.segments()
+            for path in segments:
+                offset = self._drain_segment(path, writer, max_attempts,
+                                             backoff, max_backoff)
+                if offset is None:
+                    return False
+
+                # a partial line can only be left by an append that died.
+                # The newest segment is kept until appending ends it, so
+                # that nothing after the saved offset is lost.
+                if offset < os.path.getsize(path) and path == segments[-1]:
+                    continue
+
+                os.unlink(path)
+                if os.path.exists(path + OFFSET_SUFFIX):
+                    os.unlink(path + OFFSET_SUFFIX)
+
+        return True
+
+    def _drain_segment(self, path, writer, max_attempts, backoff,
+                       max_backoff):
+        """Drain the complete lines of one segment from its saved offset,
+           returning the offset of the end of the last one, or None if a
+           batch could not be written"""
+        offset = self._read_offset(path)
+
+        with open(path) as f:
+            f.seek(offset)
+            while True:
+                batch = []
+                # the end of the last complete line read
+                end = offset
+                while len(batch) < writer.batch_size:
+                    line = f.readline()
+                    # a partial line is the end of an append that died
+                    if not line.endswith("\n"):
+                        break
+                    end += len(line)
+                    try:
+                        rec = json.loads(line)
+                    except ValueError:
+                        continue
+                    batch.append(InfluxResult08(rec['measurement'],
+                                                tags=rec['tags'],
+                                                timestamp=rec['timestamp'],
+                                                fields=rec['fields']))
+                if not batch:
+                    if end != offset:
+                        # only bad records were left
+                        self._write_offset(path, end)
+                    return end
+
+                wait = backoff
+                for attempt in range(max_attempts):
+                    try:
+                        writer.write(batch)
+                        break
+                    except Exception as e:
+                        if attempt == max_attempts - 1:
+                            return None
+                        time.sleep(wait)
+                        wait = min(wait * 2, max_backoff)
+
+                # resume after the last line written next time
+                offset = end
+                self._write_offset(path, offset)
+
+    def _evict(self):
+        """Remove the oldest segments while the spool is too big or they are
+           too old"""
+        segments = self.segments()
+        total = sum(os.path.getsize(x) for x in segments)
+        now = time.time()
+
+        # never evict the segment being appended to
+        for path in segments[:-1]:
+            if total <= self.max_bytes and \
+               now - os.path.getmtime(path) <= self.max_age:
+                break
+            total -= os.path.getsize(path)
+            os.unlink(path)
+            if os.path.exists(path + OFFSET_SUFFIX):
+                os.unlink(path + OFFSET_SUFFIX)
+
+    def _segment_path(self, number):
+        return os.path.join(self.directory,
+                            "%012d%s" % (number, SEGMENT_SUFFIX))
+
+    def _segment_number(self, path):
+        return int(os.path.basename(path)[:-len(SEGMENT_SUFFIX)])
+
+    def _read_offset(self, path):
+        try:
+            with open(path + OFFSET_SUFFIX) as f:
+                return int(f.read())
+        except (IOError, ValueError):
+            return 0
+
+    def _write_offset(self, path, offset):
+        tmp_path = path + OFFSET_SUFFIX + ".tmp"
+        with open(tmp_path, 'w') as f:
+            f.write("%d" % offset)
+        os.rename(tmp_path, path + OFFSET_SUFFIX)
+
+# vim: et:ai:sw=4:ts=4
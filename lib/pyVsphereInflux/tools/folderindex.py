@@ -0,0 +1,203 @@
+"""A persistent index of the resolved paths of vSphere folders, kept up to
+   date between runs from the changes reported by a PropertyCollector"""
+import sqlite3
+import threading
+
+class FolderScope(object):
+    """The folders below one root folder, such as the vm folder of a
+       datacenter, with the folder path and measurement suffix of each
+       resolved so that looking up the path of a vm's parent is a dict
+       lookup.  Also remembers the PropertyCollector and the version its
+       changes have been applied up to."""
+    def __init__(self, scope, root, collector=None, version=None,
+                 folders=None, paths=None):
+        """
+            Arguments:
+                scope: the key of the scope, see FolderIndex.scope
+                root: the id of the root folder
+                collector: the id of the PropertyCollector reporting the
+                           changes to the folders
+                version: the version of the last change applied
+                folders: a dict of folder id to a (name, parent id) tuple
+                paths: a dict of folder id to a (folder path, measurement
+                       suffix) tuple
+        """
+        self.scope = scope
+        self.root = root
+        self.collector = collector
+        self.version = version
+        self.folders = folders or {}
+        self.paths = paths or {}
+        self.paths[root] = ("", "")
+        # folders whose row needs writing or removing
+        self.dirty = set()
+        # the paths with the measurement prepended, per measurement
+        self.resolved = {}
+
+    def reset(self):
+        """Forget the collector, so every folder is reloaded"""
+        self.collector = None
+        self.version = None
+
+    def set_folder(self, moid, name, parent):
+        """Record the name and parent of a folder"""
+        if self.folders.get(moid) != (name, parent):
+            self.folders[moid] = (name, parent)
+            self.dirty.add(moid)
+
+    def remove_folder(self, moid):
+        """Forget a folder"""
+        if moid in self.folders:
+            del self.folders[moid]
+            self.dirty.add(moid)
+
+    def resolve(self, convert):
+        """Resolve the paths again if any folder changed, marking the
+           folders whose path changed as dirty
+            Arguments:
+                convert: a function sanitizing a folder name for the
+                         measurement name, eg. convert_to_alnum
+        """
+        if not self.dirty:
+            return
+
+        paths = {self.root: ("", "")}
+        for moid in self.folders:
+            # walk up until we hit a folder that is already resolved
+            chain = []
+            cur = moid
+            while cur not in paths and cur in self.folders:
+                chain.append(cur)
+                cur = self.folders[cur][1]
+            if cur not in paths:
+                # not below the root
+                continue
+            for cur in reversed(chain):
+                name, parent = self.folders[cur]
+                parent_path, parent_suffix = paths[parent]
+                paths[cur] = ("%s/%s" % (parent_path, name),
+                              "%s.%s" % (parent_suffix, convert(name)))
+
+        for moid in set(paths) | set(self.paths):
+            if paths.get(moid) != self.paths.get(moid):
+                self.dirty.add(moid)
+        self.paths = paths
+        self.resolved = {}
+
+    def lookup(self, moid, measurement):
+        """Return the (folder path, measurement) tuple of a folder, or None
+           if it isn't known to be below the root"""
+        resolved = self.resolved.setdefault(measurement, {})
+        try:
+            return resolved[moid]
+        except KeyError:
+            pass
+
+        if moid not in self.paths:
+            return None
+        path, suffix = self.paths[moid]
+        resolved[moid] = (path, measurement + suffix)
+        return resolved[moid]
+
+class FolderIndex(object):
+    """An SQLite database of FolderScopes.  It is safe to share between
+       threads."""
+    def __init__(self, path):
+        """
+            Arguments:
+                path: the database file, created if it doesn't exist
+        """
+        self.path = path
+        self.lock = threading.Lock()
+        # over all saves
+        self.written = 0
+        self.removed = 0
+        # scopes reloaded in full, and brought up to date from changes
+        self.reloads = 0
+        self.refreshes = 0
+
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        with self.db:
+            self.db.execute("create table if not exists scopes ("
+                            "scope text primary key, "
+                            "collector text, "
+                            "version text)")
+            self.db.execute("create table if not exists folders ("
+                            "scope text not null, "
+                            "moid text not null, "
+                            "name text not null, "
+                            "parent text not null, "
+                            "path text, "
+                            "suffix text, "
+                            "primary key (scope, moid))")
+
+    @staticmethod
+    def scope(service_instance, folder):
+        """Return the key of the folders below a root folder, which is only
+           unique within a vCenter"""
+        return "%s/%s" % (service_instance.content.about.instanceUuid,
+                          folder._moId)
+
+    def load(self, scope, root):
+        """Return the FolderScope of a root folder, empty if it isn't in the
+           index yet
+            Arguments:
+                scope: the key of the root folder, as returned from scope
+                root: the id of the root folder
+        """
+        with self.lock:
+            row = self.db.execute("select collector, version from scopes "
+                                  "where scope = ?", (scope,)).fetchone()
+            rows = self.db.execute("select moid, name, parent, path, suffix "
+                                   "from folders where scope = ?",
+                                   (scope,)).fetchall()
+
+        folders = {}
+        paths = {}
+        for moid, name, parent, path, suffix in rows:
+            moid = str(moid)
+            folders[moid] = (name, str(parent))
+            if path is not None:
+                paths[moid] = (path, str(suffix))
+
+        if row is None:
+            return FolderScope(scope, root, folders=folders, paths=paths)
+        return FolderScope(scope, root, collector=row[0], version=row[1],
+                           folders=folders, paths=paths)
+
+    def save(self, folder_scope):
+        """Write the collector, version and changed folders of a
+           FolderScope"""
+        written = []
+        removed = []
+        for moid in folder_scope.dirty:
+            if moid in folder_scope.folders:
+                # folders not (yet) below the root are kept without a path
+                name, parent = folder_scope.folders[moid]
+                path, suffix = folder_scope.paths.get(moid, (None, None))
+                written.append((folder_scope.scope, moid, name, parent, path,
+                                suffix))
+            elif moid != folder_scope.root:
+                removed.append((folder_scope.scope, moid))
+
+        with self.lock:
+            with self.db:
+                self.db.execute("insert or replace into scopes "
+                                "values (?, ?, ?)",
+                                (folder_scope.scope, folder_scope.collector,
+                                 folder_scope.version))
+                self.db.executemany("insert or replace into folders "
+                                    "values (?, ?, ?, ?, ?, ?)", written)
+                self.db.executemany("delete from folders "
+                                    "where scope = ? and moid = ?", removed)
+            self.written += len(written)
+            self.removed += len(removed)
+
+        folder_scope.dirty = set()
+
+    def close(self):
+        """Close the database"""
+        with self.lock:
+            self.db.close()
+
+# vim: et:ai:sw=4:ts=4
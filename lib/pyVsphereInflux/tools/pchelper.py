@@ -30,7 +30,126 @@ def collect_properties(service_instance, view_ref, obj_type, path_set=None,
 
     """
     collector = service_instance.content.propertyCollector
+    filter_spec = build_filter_spec(view_ref, {obj_type: path_set})
 
+    # Retrieve properties
+    props = collector.RetrieveContents([filter_spec])
+
+    return [object_content_to_dict(obj, include_mors) for obj in props]
+
+
+def collect_multi_properties(service_instance, view_ref, type_paths,
+                             include_mors=True):
+    """
+    Collect properties for several managed object types from a view ref
+    in a single PropertyCollector round trip
+
+    Args:
+        si          (ServiceInstance): ServiceInstance connection
+        view_ref (pyVmomi.vim.view.*): Starting point of inventory navigation
+        type_paths             (dict): Map of managed object type to the list
+                                       of properties to retrieve for it
+        include_mors           (bool): If True include the managed objects
+                                       refs in the result
+
+    Returns:
+        A list of properties for the managed objects of all of the types
+
+    """
+    collector = service_instance.content.propertyCollector
+    filter_spec = build_filter_spec(view_ref, type_paths)
+
+    props = collector.RetrieveContents([filter_spec])
+
+    return [object_content_to_dict(obj, include_mors) for obj in props]
+
+
+def iter_properties(service_instance, view_ref, obj_type, path_set=None,
+                    include_mors=False, max_objects=None):
+    """
+    Generator variant of collect_properties which retrieves the properties
+    a page at a time using RetrievePropertiesEx/ContinueRetrievePropertiesEx
+
+    Args:
+        si          (ServiceInstance): ServiceInstance connection
+        view_ref (pyVmomi.vim.view.*): Starting point of inventory navigation
+        obj_type      (pyVmomi.vim.*): Type of managed object
+        path_set               (list): List of properties to retrieve
+        include_mors           (bool): If True include the managed objects
+                                       refs in the result
+        max_objects             (int): Maximum number of objects per page,
+                                       None lets the server decide
+
+    Yields:
+        The properties of each managed object
+
+    """
+    return iter_multi_properties(service_instance, view_ref,
+                                 {obj_type: path_set},
+                                 include_mors=include_mors,
+                                 max_objects=max_objects)
+
+
+def iter_multi_properties(service_instance, view_ref, type_paths,
+                          include_mors=True, max_objects=None):
+    """
+    Generator variant of collect_multi_properties which retrieves the
+    properties a page at a time using
+    RetrievePropertiesEx/ContinueRetrievePropertiesEx, so only one page of
+    results is held in memory at once
+
+    Args:
+        si          (ServiceInstance): ServiceInstance connection
+        view_ref (pyVmomi.vim.view.*): Starting point of inventory navigation
+        type_paths             (dict): Map of managed object type to the list
+                                       of properties to retrieve for it
+        include_mors           (bool): If True include the managed objects
+                                       refs in the result
+        max_objects             (int): Maximum number of objects per page,
+                                       None lets the server decide
+
+    Yields:
+        The properties of each managed object
+
+    """
+    collector = service_instance.content.propertyCollector
+    filter_spec = build_filter_spec(view_ref, type_paths)
+
+    options = pyVmomi.vmodl.query.PropertyCollector.RetrieveOptions()
+    options.maxObjects = max_objects
+
+    result = collector.RetrievePropertiesEx(specSet=[filter_spec],
+                                            options=options)
+    try:
+        while result is not None:
+            for obj in result.objects:
+                yield object_content_to_dict(obj, include_mors)
+
+            if not result.token:
+                break
+            token = result.token
+            result = None
+            result = collector.ContinueRetrievePropertiesEx(token=token)
+    finally:
+        # the consumer stopped early, so release the server side results
+        if result is not None and result.token:
+            collector.CancelRetrievePropertiesEx(token=result.token)
+
+
+def build_filter_spec(view_ref, type_paths):
+    """
+    Build a property filter specification that walks a view ref
+
+    Args:
+        view_ref (pyVmomi.vim.view.*): Starting point of inventory navigation
+        type_paths             (dict): Map of managed object type to the list
+                                       of properties to retrieve for it, a
+                                       false-y list retrieves all properties
+
+    Returns:
+        A pyVmomi.vmodl.query.PropertyCollector.FilterSpec
+
+    """
     # Create object specification to define the starting point of
     # inventory navigation
     obj_spec = pyVmomi.vmodl.query.PropertyCollector.ObjectSpec()
@@ -45,35 +164,48 @@ def collect_properties(service_instance, view_ref, obj_type, path_set=None,
     traversal_spec.type = view_ref.__class__
     obj_spec.selectSet = [traversal_spec]
 
-    # Identify the properties to the retrieved
-    property_spec = pyVmomi.vmodl.query.PropertyCollector.PropertySpec()
-    property_spec.type = obj_type
+    # Identify the properties to the retrieved, one spec per type
+    property_specs = []
+    for obj_type, path_set in type_paths.items():
+        property_spec = pyVmomi.vmodl.query.PropertyCollector.PropertySpec()
+        property_spec.type = obj_type
 
-    if not path_set:
-        property_spec.all = True
+        if not path_set:
+            property_spec.all = True
 
-    property_spec.pathSet = path_set
+        property_spec.pathSet = path_set
+        property_specs.append(property_spec)
 
     # Add the object and property specification to the
     # property filter specification
     filter_spec = pyVmomi.vmodl.query.PropertyCollector.FilterSpec()
     filter_spec.objectSet = [obj_spec]
-    filter_spec.propSet = [property_spec]
+    filter_spec.propSet = property_specs
 
-    # Retrieve properties
-    props = collector.RetrieveContents([filter_spec])
+    return filter_spec
 
-    data = []
-    for obj in props:
-        properties = {}
-        for prop in obj.propSet:
-            properties[prop.name] = prop.val
 
-        if include_mors:
-            properties['obj'] = obj.obj
+def object_content_to_dict(obj, include_mors=False):
+    """
+    Flatten an ObjectContent returned by the PropertyCollector into a dict
+
+    Args:
+        obj  (ObjectContent): a single result from the PropertyCollector
+        include_mors  (bool): If True include the managed object ref under
+                              the 'obj' key
+
+    Returns:
+        A dict of property name to value
+
+    """
+    properties = {}
+    for prop in obj.propSet:
+        properties[prop.name] = prop.val
+
+    if include_mors:
+        properties['obj'] = obj.obj
 
-        data.append(properties)
-    return data
+    return properties
 
 
 def get_container_view(service_instance, obj_type, container=None, recursive=True):
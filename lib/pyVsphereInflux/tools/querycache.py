@@ -0,0 +1,221 @@
+"""
+On-disk cache of InfluxDB query results, so that re-running a report with
+different presentation options doesn't query the database again.
+"""
+
+import os
+import re
+import json
+import time
+import hashlib
+import datetime
+import threading
+
+# an upper bound on time, either epoch based or a date string
+EPOCH_END = re.compile(r"\btime\s*<=?\s*(\d+)(s|ms|u)?\b", re.IGNORECASE)
+DATE_END = re.compile(r"\btime\s*<=?\s*'([^']+)'", re.IGNORECASE)
+DATE_FORMATS = ('%Y-%m-%d', '%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M:%S.%f')
+EPOCH_DIVISORS = {'s': 1, 'ms': 10**3, 'u': 10**6}
+
+
+def normalize_query(query):
+    """Collapse the whitespace in a query, which doesn't change its result"""
+    return " ".join(query.split())
+
+
+def client_dsn(client):
+    """Identify the database an InfluxDBClient is connected to"""
+    return "%s@%s:%s/%s" % (getattr(client, '_username', ''),
+                            getattr(client, '_host', ''),
+                            getattr(client, '_port', ''),
+                            getattr(client, '_database', ''))
+
+
+def query_end(query):
+    """
+    Return the end of the time window of a query in epoch seconds, or None
+    if it has no fixed end (no upper bound, or one relative to now())
+    """
+    if "now()" in query.lower():
+        return None
+
+    match = EPOCH_END.search(query)
+    if match:
+        return float(match.group(1)) / EPOCH_DIVISORS[match.group(2) or 's']
+
+    match = DATE_END.search(query)
+    if match:
+        for fmt in DATE_FORMATS:
+            try:
+                end = datetime.datetime.strptime(match.group(1), fmt)
+            except ValueError:
+                continue
+            return (end - datetime.datetime(1970, 1, 1)).total_seconds()
+
+    return None
+
+
+def window_end(interval, now=None):
+    """
+    Return the start of the bucket of interval seconds containing now, as
+    GROUP BY time() aligns them.  A query whose time window ends there
+    rather than at now() only covers complete buckets, so with past_only
+    its result can be cached.
+    """
+    if now is None:
+        now = time.time()
+    return int(now // interval * interval)
+
+
+class QueryCache(object):
+    """
+    A directory of cached query results with a time to live and a size limit,
+    beyond which the least recently used results are evicted
+    """
+    def __init__(self, directory, ttl=3600, max_bytes=256 * 2**20,
+                 past_only=False):
+        """
+        Args:
+            directory  (str): the directory to keep the results in
+            ttl        (int): seconds a result stays valid for
+            max_bytes  (int): the most space to use for results
+            past_only (bool): only cache queries whose time window ended in
+                              the past, whose results can't change
+        """
+        self.directory = directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.past_only = past_only
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        # the bytes used by results, counted up from the last eviction
+        # rather than listing the directory after every result, and the
+        # time of that eviction.  Other processes sharing the directory
+        # aren't counted, so it is also evicted every ttl seconds.
+        self.size = None
+        self.evicted = 0
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def query(self, client, query, dsn=None):
+        """
+        Return the cached result of a query if there is one, otherwise run it
+        with client.query() and cache the result
+
+        Args:
+            client (InfluxDBClient): the client to query with
+            query             (str): the query
+            dsn               (str): the DSN of the client, which is
+                                     otherwise worked out from the client
+
+        Returns:
+            The return value of InfluxDBClient.query()
+
+        """
+        if dsn is None:
+            dsn = client_dsn(client)
+
+        res = self.get(dsn, query)
+        if res is None:
+            res = client.query(query)
+            self.put(dsn, query, res)
+        return res
+
+    def get(self, dsn, query):
+        """
+        Return the cached result of a query, or None if there is none or it
+        may not be cached, see query
+        """
+        if not self.cacheable(query):
+            return None
+
+        res = self._get(self._path(dsn, query))
+        with self.lock:
+            if res is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return res
+
+    def put(self, dsn, query, res):
+        """Cache the result of a query if it may be cached, see query"""
+        if self.cacheable(query):
+            self._put(self._path(dsn, query), res)
+
+    def cacheable(self, query):
+        """Whether a query's results may be cached"""
+        if not self.past_only:
+            return True
+        end = query_end(query)
+        return end is not None and end < time.time()
+
+    def _path(self, dsn, query):
+        key = hashlib.sha1("%s\n%s" % (dsn, normalize_query(query)))
+        return os.path.join(self.directory, key.hexdigest() + ".json")
+
+    def _get(self, path):
+        try:
+            with open(path) as f:
+                entry = json.load(f)
+        except (IOError, ValueError):
+            return None
+
+        if time.time() - entry['created'] > self.ttl:
+            return None
+
+        # the modification time records the last use, for eviction
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+
+        return entry['response']
+
+    def _put(self, path, res):
+        tmp_path = "%s.%d.%d.tmp" % (path, os.getpid(),
+                                     threading.current_thread().ident)
+        with open(tmp_path, 'w') as f:
+            json.dump({'created': time.time(), 'response': res}, f)
+        size = os.path.getsize(tmp_path)
+        os.rename(tmp_path, path)
+
+        with self.lock:
+            if self.size is not None:
+                self.size += size
+            if self.size is None or self.size > self.max_bytes or \
+               time.time() - self.evicted > self.ttl:
+                self._evict()
+
+    def _evict(self):
+        """Remove expired results, then the least recently used ones until
+           the cache fits in max_bytes"""
+        entries = []
+        now = time.time()
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+
+        entries.sort()
+        total = sum(x[1] for x in entries)
+        for mtime, size, path in entries:
+            # an entry can't be used for longer than ttl past its last use
+            if total <= self.max_bytes and now - mtime <= self.ttl:
+                continue
+            try:
+                os.unlink(path)
+            except OSError:
+                continue
+            total -= size
+
+        self.size = total
+        self.evicted = now
+
+# vim: et:ai:sw=4:ts=4
@@ -1,10 +1,163 @@
 import re
+import threading
+
+NON_ALNUM = re.compile(r'[^a-zA-Z0-9_-]')
+
+class SeriesKeys(object):
+    """A registry of sanitized name components and the measurement names
+       built from them, shared by every collector and kept between the
+       cycles of a long running collector.  The same few thousand folder,
+       vm and tag names are sanitized over and over, so each is only run
+       through the regex once while it stays in use.
+
+       Each cache is bounded by keeping two generations of dicts: entries
+       are added to the current one, and an entry found in the previous one
+       is moved up, so when the current one fills up and replaces the
+       previous one only the entries not used for a whole generation are
+       dropped.  This approximates an LRU with only builtin dict operations,
+       which unlike an OrderedDict are cheaper than the regex they save.
+    """
+    def __init__(self, max_size=100000):
+        """
+            Arguments:
+                max_size: the most entries to keep in each cache
+        """
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        # current and previous generation of sanitized components, of
+        # measurement names and of interned tag keys and values
+        self.components = ({}, {})
+        self.measurements = ({}, {})
+        self.values = ({}, {})
+        # hits and misses of each cache, counted without the lock, so
+        # approximate with many threads
+        self.counts = {
+            'components': [0, 0],
+            'measurements': [0, 0],
+            'values': [0, 0],
+        }
+
+    def _get(self, cache, key):
+        """Return a cached value or None, moving it up from the previous
+           generation"""
+        value = cache[0].get(key)
+        if value is None:
+            value = cache[1].get(key)
+            if value is not None:
+                self._put(cache, key, value)
+        return value
+
+    def _put(self, cache, key, value):
+        """Add a value to the current generation of a cache"""
+        if len(cache[0]) >= self.max_size // 2:
+            with self.lock:
+                if len(cache[0]) >= self.max_size // 2:
+                    cache[1].clear()
+                    cache[1].update(cache[0])
+                    cache[0].clear()
+        cache[0][key] = value
+
+    def alnum(self, s, replace="_"):
+        """Return s with every character but alphanumerics, hyphen and
+           underscore replaced by replace, see convert_to_alnum"""
+        # 'a' == u'a', so the type is part of the key to return the same
+        # type as the regex would
+        if replace == "_":
+            key = (type(s), s)
+        else:
+            key = (type(s), s, replace)
+        counts = self.counts['components']
+        value = self._get(self.components, key)
+        if value is not None:
+            counts[0] += 1
+            return value
+
+        counts[1] += 1
+        value = NON_ALNUM.sub(replace, s)
+        self._put(self.components, key, value)
+        return value
+
+    def measurement(self, measurement, names):
+        """Return the measurement name measurement.a.b for a tuple of names
+           (a, b), with each name sanitized.  Names that aren't strings are
+           converted with str first.  The same string is returned for the
+           same names for as long as it is cached, so the points of every
+           cycle share it."""
+        key = (measurement, names, tuple(type(name) for name in names))
+        counts = self.counts['measurements']
+        value = self._get(self.measurements, key)
+        if value is not None:
+            counts[0] += 1
+            return value
+
+        counts[1] += 1
+        parts = [measurement]
+        for name in names:
+            if not isinstance(name, basestring):
+                name = str(name)
+            parts.append(self.alnum(name))
+        value = ".".join(parts)
+        self._put(self.measurements, key, value)
+        return value
+
+    def intern(self, value):
+        """Return a shared copy of a tag key or value, so that the results
+           of every object and cycle share one copy of eg. a datastore name.
+           Unlike the intern builtin this also handles unicode, and old
+           values are dropped like the other caches."""
+        try:
+            key = (type(value), value)
+            shared = self._get(self.values, key)
+        except TypeError:
+            # unhashable
+            return value
+
+        counts = self.counts['values']
+        if shared is not None:
+            counts[0] += 1
+            return shared
+
+        counts[1] += 1
+        if value is not None:
+            self._put(self.values, key, value)
+        return value
+
+    def tags(self, tags):
+        """Return a copy of a dict of tags with the keys and values
+           interned"""
+        intern = self.intern
+        return dict((intern(k), intern(v)) for k, v in tags.iteritems())
+
+    def stats(self):
+        """Return a dict of the hits, misses, hit rate and number of cached
+           entries of each cache, by the names components, measurements and
+           values"""
+        stats = {}
+        for name, cache in (('components', self.components),
+                            ('measurements', self.measurements),
+                            ('values', self.values)):
+            hits, misses = self.counts[name]
+            lookups = hits + misses
+            stats[name] = {
+                'hits': hits,
+                'misses': misses,
+                'hit_rate': float(hits) / lookups if lookups else 0.0,
+                'size': len(cache[0]) + len(cache[1]),
+            }
+        return stats
+
+# the registry shared by every collector in the process
+series_keys = SeriesKeys()
 
 def convert_to_alnum(s, replace="_"):
     """Return s filtered to replace all non alphanumeric, hyphen, or underscore
        with the character given by replace
     """
-    return re.sub(r'[^a-zA-Z0-9_-]', replace, s)
+    return series_keys.alnum(s, replace)
 
-# vim: et:ai:sw=4:ts=4
+def measurement_name(measurement, *names):
+    """Return the measurement name measurement.a.b for names a and b, each
+       sanitized with convert_to_alnum"""
+    return series_keys.measurement(measurement, names)
 
+# vim: et:ai:sw=4:ts=4
@@ -0,0 +1,190 @@
+"""
+Persist vSphere session cookies between runs, so that a cron job can skip
+the login round trips while its session is still active.
+"""
+
+import os
+import json
+import threading
+import requests
+
+from xml.etree import ElementTree
+
+from pyVim import connect
+from pyVmomi import vim, SoapStubAdapter
+from pyVmomi.VmomiSupport import GetServiceVersions, versionIdMap
+
+
+def set_stub_timeout(stub, timeout):
+    """
+    Set the socket timeout of the connections of a SoapStubAdapter, which
+    unlike socket.setdefaulttimeout only applies to this vCenter
+
+    Args:
+        stub (SoapStubAdapter): the stub of a service instance
+        timeout      (float): the timeout in seconds, or None for none
+
+    """
+    stub.schemeArgs['timeout'] = timeout
+    # pooled connections were opened without it
+    stub.DropConnections()
+
+
+def find_api_version(host, port=443, timeout=None):
+    """
+    Return the newest vim25 API version both pyVmomi and a vCenter support,
+    as pyVim.connect.SmartConnect does, but with a timeout
+
+    Args:
+        host (str): the vCenter to ask
+        port (int): vSphere port
+        timeout (float): the timeout of the request in seconds
+
+    """
+    url = "https://%s:%d/sdk/vimServiceVersions.xml" % (host, port)
+    resp = requests.get(url, verify=False, timeout=timeout)
+    resp.raise_for_status()
+    supported = set(x.text for x in
+                    ElementTree.fromstring(resp.content).iter('version'))
+    for version in GetServiceVersions('vim25'):
+        if versionIdMap[version] in supported:
+            return version
+
+    raise Exception("%s:%s is not a VIM server" % (host, port))
+
+
+def smart_connect(host, user, pwd, port=443, timeout=None):
+    """
+    Log in like pyVim.connect.SmartConnect, with the socket timeout applying
+    to the version check and login as well, which SmartConnect has no way to
+    set.  Disconnect the service instance with pyVim.connect.Disconnect.
+
+    Args:
+        host (str): the vCenter to connect to
+        user (str): vSphere username
+        pwd  (str): vSphere password
+        port (int): vSphere port
+        timeout (float): the socket timeout of the connection, see
+                         set_stub_timeout
+
+    Returns:
+        A service instance as returned from pyVim.connect.SmartConnect
+
+    """
+    if timeout is None:
+        return connect.SmartConnect(host=host, user=user, pwd=pwd, port=port)
+
+    stub = SoapStubAdapter(host=host, port=port,
+                           version=find_api_version(host, port, timeout))
+    set_stub_timeout(stub, timeout)
+    service_instance = vim.ServiceInstance("ServiceInstance", stub)
+    service_instance.content.sessionManager.Login(user, pwd, None)
+
+    return service_instance
+
+
+class SessionCache(object):
+    """
+    An on-disk cache of session cookies keyed by vCenter, port and user
+
+    The cache file is created readable and writable only by its owner, since
+    a session cookie is as good as a password until the session expires.
+    """
+    def __init__(self, path):
+        """
+        Args:
+            path (str): the file to keep the sessions in
+        """
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def connect(self, host, user, pwd, port=443, timeout=None):
+        """
+        Return a service instance for a cached session if it is still active,
+        otherwise log in with smart_connect and cache the new session.  Cached sessions are left logged in, so the caller should not
+        Disconnect them.
+
+        Args:
+            host (str): the vCenter to connect to
+            user (str): vSphere username
+            pwd  (str): vSphere password
+            port (int): vSphere port
+            timeout (float): the socket timeout of the connection, see
+                             set_stub_timeout
+
+        Returns:
+            A service instance as returned from pyVim.connect.SmartConnect
+
+        """
+        key = "%s@%s:%d" % (user, host, port)
+
+        with self.lock:
+            entry = self._load().get(key)
+
+        if entry is not None:
+            service_instance = self._resume(host, port, entry, timeout)
+            if service_instance is not None:
+                with self.lock:
+                    self.hits += 1
+                return service_instance
+
+        service_instance = smart_connect(host, user, pwd, port=port,
+                                         timeout=timeout)
+
+        with self.lock:
+            self.misses += 1
+            sessions = self._load()
+            sessions[key] = {'cookie': service_instance._stub.cookie,
+                             'version': service_instance._stub.version}
+            self._save(sessions)
+
+        return service_instance
+
+    def hit_rate(self):
+        """Return the fraction of connections served from the cache"""
+        total = self.hits + self.misses
+        if total == 0:
+            return 0.0
+        return float(self.hits) / total
+
+    def _resume(self, host, port, entry, timeout=None):
+        """Rebuild a service instance from a cache entry, or None if the
+           session is no longer active"""
+        stub = SoapStubAdapter(host=host, port=port, version=entry['version'])
+        stub.cookie = entry['cookie']
+        if timeout is not None:
+            set_stub_timeout(stub, timeout)
+        service_instance = vim.ServiceInstance("ServiceInstance", stub)
+
+        # currentSession is a cheap check, and is unset for an expired cookie
+        try:
+            if service_instance.content.sessionManager.currentSession is None:
+                return None
+        except Exception:
+            return None
+
+        return service_instance
+
+    def _load(self):
+        """Read the cached sessions, treating a missing or corrupt file as
+           empty"""
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return {}
+
+    def _save(self, sessions):
+        """Atomically replace the cache file, with owner only permissions"""
+        tmp_path = "%s.%d.tmp" % (self.path, os.getpid())
+        # O_EXCL so that the mode below is the one the file ends up with
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0600)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(sessions, f)
+        os.rename(tmp_path, self.path)
+
+# vim: et:ai:sw=4:ts=4
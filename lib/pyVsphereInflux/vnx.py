@@ -1,14 +1,138 @@
 """Tools for connecting to VNX and collecting data using naviseccli"""
+import os
 import sys
 import re
-from subprocess import check_output
+import signal
+import threading
+from subprocess import Popen, PIPE, CalledProcessError
 
 import pyVsphereInflux.tools.humanreadable as hr
-from pyVsphereInflux import InfluxResult08
+from pyVsphereInflux.builder import get_builder
 from pyVsphereInflux.tools.regex import convert_to_alnum
 
-        
-def build_vnx(vnx, tags, fields, measurement='vnxprop', args=None):
+# value conversions, tried in order, for values of keys without a special
+# parser
+VALUE_TYPES = [
+    (lambda value: value.isdigit(), int),
+    (re.compile(r'[0-9]+\.[0-9]*').match, float),
+    (lambda value: value.endswith(hr.SYMBOLS), hr.human2bytes),
+]
+
+# python 2's Popen isn't thread-safe: the preexec_fn runs python code in
+# the child between fork and exec, which can deadlock on a lock another
+# thread held at the fork, and a pipe created by one Popen can leak into
+# a child forked by another before it is marked close-on-exec, holding the
+# pipe open past the end of the first naviseccli.  run_navi is called from
+# a ThreadPool, so only the starting of processes is serialized.
+_popen_lock = threading.Lock()
+
+class VNXTimeout(Exception):
+    """naviseccli was killed for taking too long"""
+    pass
+
+def parse_luns(value, data):
+    """LUNs are logically a list, and give a synthesized LUN_Count field"""
+    value = value.split(",")
+    data["LUN_Count"] = len(value)
+    return value
+
+# keys whose values need more than a type conversion
+KEY_PARSERS = {
+    'LUNs': parse_luns,
+}
+
+def parse_value(value):
+    """Convert a value to a number where it looks like one, otherwise to an
+       alphanumeric string"""
+    for matches, convert in VALUE_TYPES:
+        if matches(value):
+            return convert(value)
+    return convert_to_alnum(value)
+
+def parse_navi(lines):
+    """Parse storagepool -list output into a dict per pool as it is read
+            Arguments:
+                lines: an iterable of lines of output
+            Results:
+                A generator of dicts of pool properties
+    """
+    keys = {}
+    data = {}
+    for line in lines:
+        # skip whitespace and blank lines
+        if line == "" or line.isspace():
+            continue
+
+        # colon-delimited key value pairs
+        key, value = line.split(":", 1)
+
+        # the same keys repeat for every pool
+        if key not in keys:
+            keys[key] = convert_to_alnum(key.strip())
+        key = keys[key]
+        value = value.strip()
+
+        # Pool Name signals the start of a new record, so yield the current
+        # record if we parsed anything from it
+        if key == "Pool_Name" and data:
+            yield data
+            data = {}
+
+        if key in KEY_PARSERS:
+            data[key] = KEY_PARSERS[key](value, data)
+        else:
+            data[key] = parse_value(value)
+
+    # grab the final record
+    if data:
+        yield data
+
+def run_navi(cmd, timeout=None):
+    """Run naviseccli and parse its output as it is produced, killing it if
+       it runs for longer than timeout seconds
+            Results:
+                A list of dicts of pool properties a la parse_navi
+    """
+    # in its own process group, so that anything it started can be killed
+    # along with it and can't hold the pipe open
+    with _popen_lock:
+        proc = Popen(cmd, stdout=PIPE, preexec_fn=os.setsid)
+    timed_out = []
+
+    def kill():
+        timed_out.append(True)
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except OSError:
+            # already exited
+            pass
+
+    timer = None
+    if timeout is not None:
+        timer = threading.Timer(timeout, kill)
+        timer.daemon = True
+        timer.start()
+
+    try:
+        recs = list(parse_navi(iter(proc.stdout.readline, "")))
+    finally:
+        proc.stdout.close()
+        proc.wait()
+        if timer is not None:
+            timer.cancel()
+
+    # leave the credentials out of any error
+    shown = cmd[:1] + cmd[7:]
+    if timed_out:
+        raise VNXTimeout("%s timed out after %s seconds" %
+                         (" ".join(shown), timeout))
+    if proc.returncode != 0:
+        raise CalledProcessError(proc.returncode, shown)
+
+    return recs
+
+def build_vnx(vnx, tags, fields, measurement='vnxprop', args=None,
+              timeout=None):
     """Build a list of InfluxResult objects
             Arguments:
                 vnx: the hostname of a VNX SP to connect to
@@ -17,6 +141,8 @@ def build_vnx(vnx, tags, fields, measurement='vnxprop', args=None):
                 measurement: the influx db measurement name to use
                 args: a argparse Namespace with the 
                       vnx_{username,password} fields
+                timeout: seconds to wait for naviseccli before killing it
+                         and raising VNXTimeout
             Results:
                 A list of InfluxResult objects suitable to insert into a
                 database.
@@ -30,69 +156,13 @@ def build_vnx(vnx, tags, fields, measurement='vnxprop', args=None):
                          "-Scope", "0",
                          "-h", vnx,
                          "storagepool", "-list", "-capacities", "-luns"]
-    naviout = check_output(cmd)
-
-    # build the result data structures
-    recs = []
-    data = {}
-    for line in naviout.splitlines():
-        # skip whitespace and blank lines
-        if line == "" or line.isspace():
-            continue
-
-        # colon-delimited key value pairs
-        key, value = line.split(":", 2)
-
-        key = convert_to_alnum(key.strip())
-        value = value.strip()
-
-        # Pool Name signals the start of a new record, so push the current
-        # record onto the list if we parsed anything from it
-        if key == "Pool_Name" and len(data.keys()) > 0:
-            recs.append(data)
-            data = {}
-
-        if key == "LUNs":
-            # LUNs are logically a list
-            value = value.split(",")
-            # synthesize a LUN_Count field
-            data["LUN_Count"] = len(value)
-        # try to convert to numbers
-        elif value.isdigit():
-            value = int(value)
-        elif re.match(r'[0-9]+\.[0-9]*', value):
-            value = float(value)
-        elif value.endswith(hr.SYMBOLS):
-            value = hr.human2bytes(value)
-        else:
-            value = convert_to_alnum(value.strip())
-
-        data[key] = value
-            
-    # grab the final record
-    if len(data.keys()) > 0:
-        recs.append(data)
+    recs = run_navi(cmd, timeout)
 
+    builder = get_builder('pool', tags, fields, name_key='Pool_Name')
     for data in recs:
-        missing_data = False
-        meas = "%s.%s" % (measurement, convert_to_alnum(data['Pool_Name']))
-        ts = InfluxResult08(meas)
-        for tag in tags:
-            try:
-                ts.tags[tag] = data[tag]
-            except KeyError as e:
-                print "Could not process %s for data %s" % (tag, data['name'])
-                missing_data = True
-        for field in fields:
-            try:
-                ts.fields[field] = data[field]
-            except KeyError as e:
-                print "Could not process %s for data %s" % (field, data['name'])
-                missing_data = True
-
-        ts.tags['vnx'] = vnx
-
-        if not missing_data:
+        ts = builder.build(data, measurement)
+        if ts is not None:
+            ts.tags['vnx'] = vnx
             res.append(ts)
 
     return res
@@ -1,11 +1,26 @@
 """Tools for connecting to vsphere and collecting data"""
+import time
 
+import pyVmomi
 from pyVmomi import vim
-from pyVsphereInflux import InfluxResult08
+from pyVsphereInflux.builder import get_builder
 from pyVsphereInflux.tools import pchelper
-from pyVsphereInflux.tools.regex import convert_to_alnum
+from pyVsphereInflux.tools.regex import convert_to_alnum, measurement_name
 
-def build_vmresultset(service_instance, tags, fields, measurement='vmprop'):
+class DeadlineExceeded(Exception):
+    """A collection ran past its deadline"""
+    pass
+
+def check_deadline(deadline):
+    """Raise DeadlineExceeded if the time.time() deadline, if any, has
+       passed"""
+    if deadline is not None and time.time() > deadline:
+        raise DeadlineExceeded("deadline passed %.0f seconds ago" %
+                               (time.time() - deadline))
+
+def build_vmresultset(service_instance, tags, fields, measurement='vmprop',
+                      single_pass=False, page_size=None, folder_index=None,
+                      deadline=None):
     """Build a list of InfluxResult objects
             Arguments:
                 service_instance: a service instance as returned from
@@ -13,10 +28,26 @@ def build_vmresultset(service_instance, tags, fields, measurement='vmprop'):
                 tags: a list of VM properties to use as Influx tags
                 fields: a list of VM propertries to use as Influx fields
                 measurement: the influx db measurement name to use
+                single_pass: walk each datacenter with one recursive
+                             container view and PropertyCollector request
+                             instead of two per folder
+                page_size: the maximum number of objects per
+                           PropertyCollector page in single_pass mode
+                folder_index: a FolderIndex to take folder paths from in
+                              single_pass mode, see iter_vms_indexed
+                deadline: a time.time() to raise DeadlineExceeded after,
+                          checked as each folder or object is collected
             Results:
                 A list of InfluxResult objects suitable to insert into a 
                 database.
     """
+    if single_pass:
+        return list(iter_vmresultset(service_instance, tags, fields,
+                                     measurement=measurement,
+                                     page_size=page_size,
+                                     folder_index=folder_index,
+                                     deadline=deadline))
+
     res = []
 
     root_folders = service_instance.content.rootFolder.childEntity
@@ -26,9 +57,9 @@ def build_vmresultset(service_instance, tags, fields, measurement='vmprop'):
         else: 
             continue
 
-        meas = "%s.%s" % (measurement, convert_to_alnum(datacenter.name))
+        meas = measurement_name(measurement, datacenter.name)
         dc_children = get_vms(service_instance, datacenter.vmFolder, 
-                              "", tags, fields, meas)
+                              "", tags, fields, meas, deadline=deadline)
 
         for dc_child in dc_children:
             dc_child.tags['datacenter'] = datacenter.name
@@ -37,7 +68,47 @@ def build_vmresultset(service_instance, tags, fields, measurement='vmprop'):
 
     return res
 
-def get_vms(service_instance, folder, parent_path, tags, fields, measurement):
+def iter_vmresultset(service_instance, tags, fields, measurement='vmprop',
+                     page_size=None, folder_index=None, deadline=None):
+    """Generator variant of build_vmresultset in single_pass mode, which
+       yields InfluxResult objects as each PropertyCollector page arrives
+            Arguments:
+                service_instance: a service instance as returned from
+                                  pyvim.connect.smartconnect
+                tags: a list of VM properties to use as Influx tags
+                fields: a list of VM propertries to use as Influx fields
+                measurement: the influx db measurement name to use
+                page_size: the maximum number of objects per
+                           PropertyCollector page
+                folder_index: a FolderIndex to take folder paths from,
+                              see iter_vms_indexed
+                deadline: a time.time() to raise DeadlineExceeded after
+            Results:
+                InfluxResult objects suitable to insert into a database.
+    """
+    root_folders = service_instance.content.rootFolder.childEntity
+    for child in root_folders:
+        if hasattr(child, 'vmFolder'):
+            datacenter = child
+        else: 
+            continue
+
+        meas = measurement_name(measurement, datacenter.name)
+        if folder_index is not None:
+            vms = iter_vms_indexed(service_instance, datacenter.vmFolder,
+                                   tags, fields, meas, folder_index,
+                                   page_size=page_size, deadline=deadline)
+        else:
+            vms = iter_vms_single_pass(service_instance, datacenter.vmFolder,
+                                       tags, fields, meas,
+                                       page_size=page_size,
+                                       deadline=deadline)
+        for ts in vms:
+            ts.tags['datacenter'] = datacenter.name
+            yield ts
+
+def get_vms(service_instance, folder, parent_path, tags, fields, measurement,
+            deadline=None):
     """Returns a list of InfluxResult objects representing the child objects
        of vm_or_folder
             Arguments:
@@ -48,10 +119,12 @@ def get_vms(service_instance, folder, parent_path, tags, fields, measurement):
                 tags: a list of VM properties to use as Influx tags
                 fields: a list of VM propertries to use as Influx fields
                 measurement: the influx db measurement name to use
+                deadline: a time.time() to raise DeadlineExceeded after
             Results:
                 A list of InfluxResult objects suitable to insert into a 
                 database.
     """
+    check_deadline(deadline)
     res = []
 
     # collect child folders
@@ -66,11 +139,10 @@ def get_vms(service_instance, folder, parent_path, tags, fields, measurement):
                                           path_set=['name'],
                                           include_mors=True)
     for child_folder in folders:
-        meas = "%s.%s" % (measurement, 
-                          convert_to_alnum(child_folder['obj'].name))
+        meas = measurement_name(measurement, child_folder['obj'].name)
         child_vms = get_vms(service_instance, child_folder['obj'], 
                             "%s/%s" % (parent_path, child_folder['obj'].name),
-                             tags, fields, meas)
+                             tags, fields, meas, deadline=deadline)
         res.extend(child_vms)
                                      
 
@@ -88,27 +160,631 @@ def get_vms(service_instance, folder, parent_path, tags, fields, measurement):
                                       include_mors=False)
 
     # put each child into res
+    builder = get_builder('vm', tags, fields)
     for vm in vms:
-        missing_data = False
-        meas = "%s.%s" % (measurement, convert_to_alnum(vm['name']))
-        ts = InfluxResult08(meas)
-        for tag in tags:
-            try:
-                ts.tags[tag] = vm[tag]
-            except KeyError as e:
-                print "Could not process %s for vm %s" % (tag, vm['name'])
-                missing_data = True
-        for field in fields:
-            try:
-                ts.fields[field] = vm[field]
-            except KeyError as e:
-                print "Could not process %s for vm %s" % (field, vm['name'])
-                missing_data = True
-        ts.tags['folderPath'] = parent_path
-
-        if not missing_data:
+        ts = vm_to_result(vm, builder, measurement, parent_path)
+        if ts is not None:
             res.append(ts)
 
     return res 
 
+def get_vms_single_pass(service_instance, folder, tags, fields, measurement,
+                        page_size=None, deadline=None):
+    """Returns a list of InfluxResult objects representing all of the VMs
+       below folder, using a single recursive container view and a single
+       PropertyCollector request.  Folder paths and measurement names are
+       rebuilt locally from the parent of each object, so the output matches
+       that of get_vms.
+            Arguments:
+                service_instance: a service instance as returned from
+                                  pyVim.connect.SmartConnect
+                folder: the root of the VM/folder tree to search
+                tags: a list of VM properties to use as Influx tags
+                fields: a list of VM propertries to use as Influx fields
+                measurement: the influx db measurement name to use
+                page_size: the maximum number of objects per
+                           PropertyCollector page
+                deadline: a time.time() to raise DeadlineExceeded after
+            Results:
+                A list of InfluxResult objects suitable to insert into a 
+                database.
+    """
+    return list(iter_vms_single_pass(service_instance, folder, tags, fields,
+                                     measurement, page_size=page_size,
+                                     deadline=deadline))
+
+def iter_vms_single_pass(service_instance, folder, tags, fields, measurement,
+                         page_size=None, deadline=None):
+    """Generator variant of get_vms_single_pass.  The PropertyCollector
+       results are consumed a page at a time, and vms are yielded as soon as
+       the path of their parent folder is known.
+            Arguments:
+                see get_vms_single_pass
+            Results:
+                InfluxResult objects suitable to insert into a database.
+    """
+    props = ['parent']
+    props.extend(tags)
+    props.extend(fields)
+    view = pchelper.get_container_view(service_instance, 
+                                       obj_type=[vim.Folder,
+                                                 vim.VirtualMachine],
+                                       container=folder,
+                                       recursive=True)
+    objs = pchelper.iter_multi_properties(service_instance, 
+                                          view_ref=view,
+                                          type_paths={
+                                             vim.Folder: ['name', 'parent'],
+                                             vim.VirtualMachine: props,
+                                          },
+                                          include_mors=True,
+                                          max_objects=page_size)
+
+    builder = get_builder('vm', tags, fields)
+    # the paths of the folders known to be below folder, the folders
+    # waiting for the path of their parent, and the vms waiting for the
+    # path of their parent folder, so only what is still unresolved is kept.
+    # Vms still waiting at the end are skipped, as with get_vms.
+    paths = {folder._moId: ("", measurement)}
+    waiting_folders = {}
+    waiting_vms = {}
+
+    try:
+        for obj in objs:
+            check_deadline(deadline)
+            if isinstance(obj['obj'], vim.Folder):
+                parent_id = obj['parent']._moId
+                if parent_id not in paths:
+                    waiting_folders.setdefault(parent_id, []).append(
+                        (obj['obj']._moId, obj['name']))
+                    continue
+
+                # resolve the folder and any folders waiting below it,
+                # releasing the vms waiting for them
+                pending = [(obj['obj']._moId, obj['name'], parent_id)]
+                while pending:
+                    moid, name, parent_id = pending.pop()
+                    parent_path, parent_meas = paths[parent_id]
+                    paths[moid] = ("%s/%s" % (parent_path, name),
+                                   "%s.%s" % (parent_meas,
+                                              convert_to_alnum(name)))
+                    for child_id, child_name in \
+                            waiting_folders.pop(moid, []):
+                        pending.append((child_id, child_name, moid))
+                    for vm in waiting_vms.pop(moid, []):
+                        ts = vm_to_result(vm, builder, paths[moid][1],
+                                          paths[moid][0])
+                        if ts is not None:
+                            yield ts
+                continue
+
+            # vms in a vApp have no parent folder, so skip them as get_vms
+            if 'parent' not in obj:
+                continue
+
+            parent = paths.get(obj['parent']._moId)
+            if parent is None:
+                waiting_vms.setdefault(obj['parent']._moId, []).append(obj)
+                continue
+
+            ts = vm_to_result(obj, builder, parent[1], parent[0])
+            if ts is not None:
+                yield ts
+    finally:
+        view.Destroy()
+
+def iter_vms_indexed(service_instance, folder, tags, fields, measurement,
+                     folder_index, page_size=None, deadline=None):
+    """Variant of iter_vms_single_pass which takes the folder paths from a
+       FolderIndex, so only the vms are retrieved and each is yielded as
+       soon as it arrives.  The index is first brought up to date with
+       sync_folder_index.
+            Arguments:
+                folder_index: a FolderIndex
+                see get_vms_single_pass for the rest
+            Results:
+                InfluxResult objects suitable to insert into a database.
+    """
+    folder_scope, collector = sync_folder_index(service_instance, folder,
+                                                folder_index)
+
+    props = ['parent']
+    props.extend(tags)
+    props.extend(fields)
+    view = pchelper.get_container_view(service_instance,
+                                       obj_type=[vim.VirtualMachine],
+                                       container=folder,
+                                       recursive=True)
+    objs = pchelper.iter_properties(service_instance, view_ref=view,
+                                    obj_type=vim.VirtualMachine,
+                                    path_set=props, include_mors=True,
+                                    max_objects=page_size)
+
+    builder = get_builder('vm', tags, fields)
+    # vms in folders created since the index was brought up to date
+    deferred = []
+    try:
+        for obj in objs:
+            check_deadline(deadline)
+            # vms in a vApp have no parent folder, so skip them as get_vms
+            if 'parent' not in obj:
+                continue
+
+            parent = folder_scope.lookup(obj['parent']._moId, measurement)
+            if parent is None:
+                deferred.append(obj)
+                continue
+
+            ts = vm_to_result(obj, builder, parent[1], parent[0])
+            if ts is not None:
+                yield ts
+    finally:
+        view.Destroy()
+
+    if not deferred:
+        return
+
+    apply_folder_updates(collector, folder_scope)
+    folder_index.save(folder_scope)
+    for vm in deferred:
+        parent = folder_scope.lookup(vm['parent']._moId, measurement)
+        if parent is None:
+            continue
+
+        ts = vm_to_result(vm, builder, parent[1], parent[0])
+        if ts is not None:
+            yield ts
+
+def sync_folder_index(service_instance, folder, folder_index):
+    """Bring the folders below folder in a FolderIndex up to date.  The
+       index remembers a private PropertyCollector with a filter on the
+       name and parent of every folder, so while the session lasts, eg.
+       with a SessionCache, only the folders changed since the last run are
+       sent.  Otherwise a new collector is created and every folder is
+       loaded.
+            Arguments:
+                service_instance: a service instance as returned from
+                                  pyVim.connect.SmartConnect
+                folder: the root folder, eg. the vm folder of a datacenter
+                folder_index: a FolderIndex
+            Results:
+                A tuple of the up to date FolderScope and the
+                PropertyCollector
+    """
+    scope = folder_index.scope(service_instance, folder)
+    folder_scope = folder_index.load(scope, folder._moId)
+
+    collector = None
+    if folder_scope.collector:
+        collector = pyVmomi.vmodl.query.PropertyCollector(
+                        folder_scope.collector, service_instance._stub)
+        try:
+            apply_folder_updates(collector, folder_scope)
+            folder_index.refreshes += 1
+        except (pyVmomi.vmodl.fault.ManagedObjectNotFound,
+                pyVmomi.vmodl.query.InvalidCollectorVersion):
+            # the session that created it is gone
+            collector = None
+            folder_scope.reset()
+
+    if collector is None:
+        pc = service_instance.content.propertyCollector
+        collector = pc.CreatePropertyCollector()
+        # the view must outlive this run for the filter to keep reporting
+        # changes, and goes when the session does
+        view = pchelper.get_container_view(service_instance,
+                                           obj_type=[vim.Folder],
+                                           container=folder,
+                                           recursive=True)
+        filter_spec = pchelper.build_filter_spec(view, {
+                                    vim.Folder: ['name', 'parent'],
+                                })
+        collector.CreateFilter(filter_spec, partialUpdates=False)
+        folder_scope.collector = collector._moId
+        apply_folder_updates(collector, folder_scope, reload=True)
+        folder_index.reloads += 1
+
+    folder_index.save(folder_scope)
+    return folder_scope, collector
+
+def apply_folder_updates(collector, folder_scope, reload=False):
+    """Apply the pending folder changes of a PropertyCollector to a
+       FolderScope and resolve its paths again
+            Arguments:
+                collector: the PropertyCollector of the FolderScope
+                folder_scope: a FolderScope
+                reload: the updates are of every folder, so forget any
+                        folder they don't include
+    """
+    options = pyVmomi.vmodl.query.PropertyCollector.WaitOptions()
+    options.maxWaitSeconds = 0
+
+    seen = set()
+    version = folder_scope.version or ""
+    while True:
+        update = collector.WaitForUpdatesEx(version=version, options=options)
+        if update is None:
+            break
+
+        for filter_update in update.filterSet:
+            for obj_update in filter_update.objectSet:
+                moid = obj_update.obj._moId
+                if obj_update.kind == 'leave':
+                    folder_scope.remove_folder(moid)
+                    continue
+
+                seen.add(moid)
+                name, parent = folder_scope.folders.get(moid, (None, None))
+                for change in obj_update.changeSet:
+                    if change.name == 'name':
+                        name = change.val
+                    elif change.name == 'parent':
+                        parent = change.val._moId
+                folder_scope.set_folder(moid, name, parent)
+
+        version = update.version
+
+    if reload:
+        for moid in folder_scope.folders.keys():
+            if moid not in seen:
+                folder_scope.remove_folder(moid)
+
+    folder_scope.version = version
+    folder_scope.resolve(convert_to_alnum)
+
+# the types whose name and parent are needed to place every object under
+# its datacenter, and folders to build vm folder paths
+INVENTORY_PATHS = {
+    vim.Datacenter: ['name', 'parent', 'vmFolder'],
+    vim.Folder: ['name', 'parent'],
+    vim.ComputeResource: ['name', 'parent'],
+}
+
+def build_inventory_resultset(service_instance, specs, page_size=None,
+                              deadline=None):
+    """Build InfluxResult objects for several types of object at once, from
+       a single recursive container view over the whole inventory and a
+       single paginated PropertyCollector retrieval
+            Arguments:
+                service_instance: a service instance as returned from
+                                  pyvim.connect.smartconnect
+                specs: a dict of vim type, eg. vim.VirtualMachine,
+                       vim.HostSystem, vim.ClusterComputeResource or
+                       vim.Datastore, to a (measurement, tags, fields) tuple
+                page_size: the maximum number of objects per
+                           PropertyCollector page
+                deadline: a time.time() to raise DeadlineExceeded after
+            Results:
+                A dict of each vim type in specs to a list of InfluxResult
+                objects.  Those for vms are as from build_vmresultset,
+                those for other types are named
+                measurement.datacenter.name and tagged with their
+                datacenter, and cluster for hosts in a cluster.
+    """
+    type_paths = {}
+    for obj_type, paths in INVENTORY_PATHS.items():
+        type_paths[obj_type] = list(paths)
+    for obj_type, (measurement, tags, fields) in specs.items():
+        paths = type_paths.setdefault(obj_type, ['name', 'parent'])
+        for path in ['name', 'parent'] + tags + fields:
+            if path not in paths:
+                paths.append(path)
+
+    root = service_instance.content.rootFolder
+    view = pchelper.get_container_view(service_instance,
+                                       obj_type=type_paths.keys(),
+                                       container=root, recursive=True)
+    # properties of each object, merged across the property specs it
+    # matches, in the order retrieved
+    objs = {}
+    order = []
+    try:
+        for obj in pchelper.iter_multi_properties(service_instance,
+                                                  view_ref=view,
+                                                  type_paths=type_paths,
+                                                  include_mors=True,
+                                                  max_objects=page_size):
+            check_deadline(deadline)
+            moid = obj['obj']._moId
+            if moid not in objs:
+                objs[moid] = obj
+                order.append(moid)
+            else:
+                objs[moid].update(obj)
+    finally:
+        view.Destroy()
+
+    # the datacenter of each object, found by walking up the parents
+    datacenters = {}
+    def datacenter_of(moid):
+        chain = []
+        while moid in objs and moid not in datacenters:
+            if isinstance(objs[moid]['obj'], vim.Datacenter):
+                datacenters[moid] = objs[moid]
+                break
+            chain.append(moid)
+            parent = objs[moid].get('parent')
+            moid = parent._moId if parent is not None else None
+        dc = datacenters.get(moid)
+        for cur in chain:
+            datacenters[cur] = dc
+        return dc
+
+    # folder parent map and paths for the vm folder of each datacenter
+    folders = {}
+    paths = {}
+    vm_spec = specs.get(vim.VirtualMachine)
+    for moid in order:
+        obj = objs[moid]
+        if isinstance(obj['obj'], vim.Folder) and 'parent' in obj:
+            folders[moid] = (obj['name'], obj['parent']._moId)
+        elif isinstance(obj['obj'], vim.Datacenter) and vm_spec is not None:
+            paths[obj['vmFolder']._moId] = \
+                ("", measurement_name(vm_spec[0], obj['name']))
+
+    res = dict((obj_type, []) for obj_type in specs)
+    builders = {}
+    for obj_type, (_, tags, fields) in specs.items():
+        kind = 'vm' if obj_type is vim.VirtualMachine \
+               else obj_type.__name__.split('.')[-1]
+        builders[obj_type] = get_builder(kind, tags, fields)
+    for moid in order:
+        obj = objs[moid]
+        for obj_type in specs:
+            if isinstance(obj['obj'], obj_type):
+                break
+        else:
+            continue
+
+        # vms in a vApp have no parent folder, so skip them as get_vms
+        if 'parent' not in obj:
+            continue
+        dc = datacenter_of(obj['parent']._moId)
+        if dc is None:
+            continue
+
+        measurement = specs[obj_type][0]
+        builder = builders[obj_type]
+        if obj_type is vim.VirtualMachine:
+            parent = resolve_folder_path(obj['parent']._moId, folders,
+                                         paths)
+            if parent is None:
+                continue
+            ts = vm_to_result(obj, builder, parent[1], parent[0])
+        else:
+            meas = measurement_name(measurement, dc['name'])
+            ts = builder.build(obj, meas)
+            if ts is not None and isinstance(obj['obj'], vim.HostSystem):
+                cluster = objs.get(obj['parent']._moId)
+                if cluster is not None and \
+                   isinstance(cluster['obj'], vim.ClusterComputeResource):
+                    ts.tags['cluster'] = cluster['name']
+
+        if ts is not None:
+            ts.tags['datacenter'] = dc['name']
+            res[obj_type].append(ts)
+
+    return res
+
+def resolve_folder_paths(folders, root, measurement):
+    """Resolve the folder path and measurement name of each folder from a
+       parent map
+            Arguments:
+                folders: a dict of folder id to a (name, parent id) tuple
+                root: the id of the folder the tree starts from
+                measurement: the influx db measurement name of root
+            Results:
+                A dict of folder id to a (folder path, measurement) tuple
+    """
+    paths = {root: ("", measurement)}
+
+    for folder_id in folders:
+        resolve_folder_path(folder_id, folders, paths)
+
+    return paths
+
+def resolve_folder_path(folder_id, folders, paths):
+    """Resolve the folder path and measurement name of a single folder,
+       recording it and any newly resolved ancestors in paths
+            Arguments:
+                folder_id: the id of the folder to resolve
+                folders: a dict of folder id to a (name, parent id) tuple
+                paths: a dict of folder id to a (folder path, measurement)
+                       tuple which already contains the root folder
+            Results:
+                A (folder path, measurement) tuple, or None if the folder is
+                not (yet) known to be below the root folder
+    """
+    # walk up until we hit a folder that is already resolved
+    chain = []
+    cur = folder_id
+    while cur not in paths:
+        if cur not in folders:
+            return None
+        chain.append(cur)
+        cur = folders[cur][1]
+
+    # then resolve back down the chain
+    for cur in reversed(chain):
+        name, parent = folders[cur]
+        parent_path, parent_meas = paths[parent]
+        paths[cur] = ("%s/%s" % (parent_path, name),
+                      "%s.%s" % (parent_meas, convert_to_alnum(name)))
+
+    return paths[folder_id]
+
+def vm_to_result(vm, builder, measurement, folder_path):
+    """Build an InfluxResult object from the properties of a vm
+            Arguments:
+                vm: a dict of vm properties as returned from
+                    pchelper.collect_properties
+                builder: the RecordBuilder of the vm tags and fields, as
+                         returned from get_builder('vm', tags, fields)
+                measurement: the influx db measurement name of the vm's
+                             parent folder
+                folder_path: the path of the vm's parent folder
+            Results:
+                An InfluxResult object, or None if any property was missing,
+                which is counted in the summary of the builder
+    """
+    ts = builder.build(vm, measurement)
+    if ts is not None:
+        ts.tags['folderPath'] = folder_path
+
+    return ts
+
+class VMUpdateCollector(object):
+    """Keep an in-memory table of vm properties up to date using a
+       persistent PropertyCollector filter and WaitForUpdatesEx, so that
+       after the initial load only changed properties are sent by vCenter.
+       Datacenters created after the collector are not tracked.
+    """
+    def __init__(self, service_instance, tags, fields, measurement='vmprop'):
+        """Register a property filter for each datacenter
+                Arguments:
+                    service_instance: a service instance as returned from
+                                      pyVim.connect.SmartConnect
+                    tags: a list of VM properties to use as Influx tags
+                    fields: a list of VM propertries to use as Influx fields
+                    measurement: the influx db measurement name to use
+        """
+        self.service_instance = service_instance
+        self.tags = tags
+        self.fields = fields
+        self.measurement = measurement
+        self.version = ""
+
+        # a private collector, so our filters don't interfere with anyone
+        # else using the session
+        pc = service_instance.content.propertyCollector
+        self.collector = pc.CreatePropertyCollector()
+
+        props = ['parent']
+        props.extend(tags)
+        props.extend(fields)
+
+        # filter id -> the state of a datacenter
+        self.datacenters = {}
+        self.views = []
+
+        root_folders = service_instance.content.rootFolder.childEntity
+        for child in root_folders:
+            if hasattr(child, 'vmFolder'):
+                datacenter = child
+            else: 
+                continue
+
+            view = pchelper.get_container_view(service_instance,
+                                               obj_type=[vim.Folder,
+                                                         vim.VirtualMachine],
+                                               container=datacenter.vmFolder,
+                                               recursive=True)
+            self.views.append(view)
+            filter_spec = pchelper.build_filter_spec(view, {
+                                        vim.Folder: ['name', 'parent'],
+                                        vim.VirtualMachine: props,
+                                    })
+            prop_filter = self.collector.CreateFilter(filter_spec,
+                                                      partialUpdates=True)
+
+            self.datacenters[prop_filter._moId] = {
+                'name': datacenter.name,
+                'root': datacenter.vmFolder._moId,
+                'measurement': measurement_name(measurement, datacenter.name),
+                # object id -> dict of properties, as from collect_properties
+                'objects': {},
+            }
+
+    def poll(self, max_wait=0):
+        """Apply all of the pending updates to the state table
+                Arguments:
+                    max_wait: seconds to wait for the first update to
+                              arrive
+                Results:
+                    The number of object updates applied
+        """
+        count = 0
+        options = pyVmomi.vmodl.query.PropertyCollector.WaitOptions()
+        options.maxWaitSeconds = max_wait
+
+        while True:
+            update = self.collector.WaitForUpdatesEx(version=self.version,
+                                                     options=options)
+            # timed out with nothing new
+            if update is None:
+                break
+
+            for filter_update in update.filterSet:
+                dc = self.datacenters[filter_update.filter._moId]
+                for obj_update in filter_update.objectSet:
+                    self._apply(dc['objects'], obj_update)
+                    count += 1
+
+            self.version = update.version
+
+            # the rest of the pending updates should already be waiting
+            options.maxWaitSeconds = 0
+
+        return count
+
+    def _apply(self, objects, obj_update):
+        """Apply a single ObjectUpdate to a table of objects"""
+        obj_id = obj_update.obj._moId
+
+        if obj_update.kind == 'leave':
+            objects.pop(obj_id, None)
+            return
+
+        if obj_update.kind == 'enter' or obj_id not in objects:
+            objects[obj_id] = {'obj': obj_update.obj}
+        props = objects[obj_id]
+
+        for change in obj_update.changeSet:
+            if change.op in ('remove', 'indirectRemove'):
+                props.pop(change.name, None)
+            else:
+                props[change.name] = change.val
+
+    def snapshot(self):
+        """Build a list of InfluxResult objects from the state table, in the
+           same form as build_vmresultset
+                Results:
+                    A list of InfluxResult objects suitable to insert into a 
+                    database.
+        """
+        res = []
+        builder = get_builder('vm', self.tags, self.fields)
+
+        for dc in self.datacenters.values():
+            folders = {}
+            vms = []
+            for props in dc['objects'].values():
+                if isinstance(props['obj'], vim.Folder):
+                    folders[props['obj']._moId] = (props['name'],
+                                                   props['parent']._moId)
+                else:
+                    vms.append(props)
+
+            paths = resolve_folder_paths(folders, dc['root'],
+                                         dc['measurement'])
+
+            for vm in vms:
+                try:
+                    folder_path, meas = paths[vm['parent']._moId]
+                except KeyError:
+                    continue
+
+                ts = vm_to_result(vm, builder, meas, folder_path)
+                if ts is not None:
+                    ts.tags['datacenter'] = dc['name']
+                    res.append(ts)
+
+        return res
+
+    def destroy(self):
+        """Remove the property filters and views from the server"""
+        self.collector.DestroyPropertyCollector()
+        for view in self.views:
+            view.Destroy()
+
 # vim: et:ai:sw=4:ts=4
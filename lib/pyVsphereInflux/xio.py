@@ -4,11 +4,167 @@ import pexpect
 
 import pyVsphereInflux.tools.humanreadable as hr
 
-from pyVsphereInflux import InfluxResult08
-from pyVsphereInflux.tools.regex import convert_to_alnum
+from pyVsphereInflux.builder import get_builder
 
-        
-def build_xiocluster(xms, tags, fields, measurement='xioprop', args=None):
+class XMSError(Exception):
+    """The XMS did not respond as expected"""
+    pass
+
+class XMSSession(object):
+    """An XMCLI session on an XMS, logged in once, over which any number of
+       show-* commands can be run"""
+    def __init__(self, xms, args, timeout=300):
+        """
+            Arguments:
+                xms: the hostname of an XtremIO XMS to connect to
+                args: a argparse Namespace with the
+                      {xmsadmin,xms}_{username,password} and debug fields
+                timeout: seconds to wait for each prompt
+        """
+        self.xms = xms
+        self.debug = args.debug
+
+        # set up some logging if we run in debug mode
+        pxlogfile = None
+        if args.debug:
+            pxlogfile = sys.stdout
+
+        # do the first xmsadmin ssh login
+        ssh_cmd = "ssh -oStrictHostKeyChecking=no -l %s %s" % \
+                    (args.xmsadmin_username, xms)
+        self.p = pexpect.spawn(ssh_cmd, logfile=pxlogfile, timeout=timeout)
+        self.prompt = r"xmcli \(%s\)>" % args.xms_username
+        try:
+            self.expect("password:")
+            self.p.sendline(args.xmsadmin_password)
+
+            # do the secondary user login (yes XtremIO is wierd)
+            self.expect("Username:")
+            self.p.sendline(args.xms_username)
+            self.expect("Password:")
+            self.p.sendline(args.xms_password)
+
+            # wait for the first prompt
+            self.expect(self.prompt)
+        except XMSError:
+            self.p.close(force=True)
+            raise
+
+    def expect(self, pattern):
+        """Wait for pattern, raising XMSError if it doesn't come"""
+        try:
+            self.p.expect(pattern)
+        except pexpect.TIMEOUT:
+            raise XMSError("timed out waiting for %s from %s" %
+                           (pattern, self.xms))
+        except pexpect.EOF:
+            raise XMSError("%s closed the connection waiting for %s" %
+                           (self.xms, pattern))
+
+    def run(self, command):
+        """Run a command, returning its output"""
+        self.p.sendline(command)
+        self.expect(self.prompt)
+        return self.p.before
+
+    def show(self, command, name_key=None):
+        """Run a show-* command, returning its table as a list of dicts,
+           see parse_show"""
+        return parse_show(self.run(command), command, name_key)
+
+    def close(self):
+        self.p.close(force=True)
+
+        # insert a newline into the debug output for clarity
+        if self.debug:
+            print
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def parse_show(output, command, name_key=None):
+    """Parse the table printed by a show-* command into a list of dicts,
+       keyed by the column names in its header line
+            Arguments:
+                output: the output of the command, starting with the
+                        command being echoed
+                command: the command run
+                name_key: a column the header has, so that any banner
+                          printed before it is skipped; default the first
+                          line after the command is the header
+            Results:
+                A list of dicts, one per row
+    """
+    lines = [line for line in output.splitlines()
+             if line != "" and not line.isspace()]
+    # the command being echoed
+    if lines and lines[0].strip().endswith(command):
+        lines = lines[1:]
+
+    # the header with a list of fields
+    for start, line in enumerate(lines):
+        if name_key is None or name_key in line.split():
+            break
+    else:
+        if name_key is None:
+            return []
+        raise XMSError("no header with %s in the output of %s" %
+                       (name_key, command))
+    header = lines[start].split()
+
+    # the data rows, parse into dicts
+    return [dict(zip(header, line.split())) for line in lines[start + 1:]]
+
+def to_number(value):
+    """Convert a value to a number if it looks like one, otherwise return
+       None"""
+    if value.isdigit():
+        return int(value)
+    elif value.endswith(hr.SYMBOLS):
+        try:
+            return hr.human2bytes(value)
+        except (AssertionError, ValueError):
+            return None
+    return None
+
+def number_or_value(value):
+    """Convert a value to a number if it looks like one, otherwise return
+       it unchanged"""
+    number = to_number(value)
+    if number is None:
+        return value
+    return number
+
+def build_xioobjects(xms, rows, name_key, tags, fields,
+                     measurement='xioprop'):
+    """Build a list of InfluxResult objects from rows of a show-* command
+            Arguments:
+                xms: the hostname of the XMS the rows came from
+                rows: a list of dicts as returned from parse_show
+                name_key: the column naming each object
+                tags: a list of columns to use as Influx tags
+                fields: a list of columns to use as Influx fields, or None
+                        for every column with a number in it
+                measurement: the influx db measurement name to use
+            Results:
+                A list of InfluxResult objects suitable to insert into a
+                database.
+    """
+    builder = get_builder(measurement.split('.')[0], tags, fields,
+                          coercions=dict((field, number_or_value)
+                                         for field in fields or []),
+                          name_key=name_key, select=to_number)
+    res = builder.build_all(rows, measurement)
+    for ts in res:
+        ts.tags['xms'] = xms
+
+    return res
+
+def build_xiocluster(xms, tags, fields, measurement='xioprop', args=None,
+                     session=None):
     """Build a list of InfluxResult objects
             Arguments:
                 xms: the hostname of an XtremIO XMS to connect to
@@ -17,86 +173,18 @@ def build_xiocluster(xms, tags, fields, measurement='xioprop', args=None):
                 measurement: the influx db measurement name to use
                 args: a argparse Namespace with the 
                       {xmsadmin,xms}_{username,password} fields
+                session: an XMSSession to use instead of logging in
             Results:
                 A list of InfluxResult objects suitable to insert into a
                 database.
     """
-    res = []
-
-    # set up some logging if we run in debug mode
-    pxlogfile = None
-    if args.debug:
-        pxlogfile = sys.stdout
-
-    # do the first xmsadmin ssh login
-    ssh_cmd = "ssh -oStrictHostKeyChecking=no -l %s %s" % \
-                (args.xmsadmin_username, xms)
-    p = pexpect.spawn(ssh_cmd, logfile=pxlogfile)
-    p.expect ("password:")
-    p.sendline(args.xmsadmin_password)
-
-    # do the secondary user login (yes XtremIO is wierd)
-    p.expect("Username:")
-    p.sendline(args.xms_username)
-    p.expect("Password:")
-    p.sendline(args.xms_password)
-
-    # check for a prompt and enter commands
-    prompt = r"xmcli \(%s\)>" % args.xms_username
-    p.expect(prompt)
-    p.sendline("show-clusters")
-    p.expect(prompt)
-    clusterout = p.before
-    p.close()
-
-    # insert a newline into the debug output for clarity
-    if args.debug:
-        print
-
-    header = None
-    for line in clusterout.splitlines():
-        # the command being echoed
-        if "show-clusters" in line:
-            continue
-        # the header with a list of fields
-        if line.startswith("Cluster-Name"):
-            header = line.split()
-            continue
-
-        # a data row, parse into adict
-        row = line.split()
-        data = {}
-        for i in range(len(row)):
-            data[header[i]] = row[i]
-        
-        # build the result object
-        missing_data = False
-        meas = "%s.%s" % (measurement, convert_to_alnum(data['Cluster-Name']))
-        ts = InfluxResult08(meas)
-        for tag in tags:
-            try:
-                ts.tags[tag] = data[tag]
-            except KeyError as e:
-                print "Could not process %s for data %s" % (tag, data['name'])
-                missing_data = True
-        for field in fields:
-            try:
-                ts.fields[field] = data[field]
-            except KeyError as e:
-                print "Could not process %s for data %s" % (field, data['name'])
-                missing_data = True
-
-            # try to convert to numbers
-            if data[field].isdigit():
-                ts.fields[field] = int(data[field])
-            elif data[field].endswith(hr.SYMBOLS):
-                ts.fields[field] = hr.human2bytes(data[field])
+    if session is None:
+        with XMSSession(xms, args) as session:
+            rows = session.show("show-clusters", 'Cluster-Name')
+    else:
+        rows = session.show("show-clusters", 'Cluster-Name')
 
-        ts.tags['xms'] = xms
-
-        if not missing_data:
-            res.append(ts)
-
-    return res
+    return build_xioobjects(xms, rows, 'Cluster-Name', tags, fields,
+                            measurement)
 
 # vim: et:ai:sw=4:ts=4
@@ -11,6 +11,7 @@ setup(name='pyVsphereInflux',
         'pyvmomi==5.5.0.2014.1.1',
         'influxdb==2.6.0',
         'pexpect==3.3',
+        'numpy==1.16.6',
       ])
       
 # vim: et:ai:sw=4:ts=4
@@ -0,0 +1,130 @@
+import re
+import unittest
+
+from pyVsphereInflux import InfluxResult08
+from pyVsphereInflux import downsample
+from pyVsphereInflux.downsample import list_series, rollup_list_spec, \
+                                       ROLLUP_INTERVAL
+
+class FakeExecutor(object):
+    """Answers the queries of list_series from a dict of the name of each
+       series to the time of its first point"""
+    def __init__(self, series):
+        self.series = series
+        self.queries = []
+
+    def matching(self, spec):
+        regex = re.compile(spec.strip('/'))
+        return sorted(name for name in self.series if regex.match(name))
+
+    def query_results(self, query):
+        self.queries.append(query)
+        if query.startswith("list"):
+            return [InfluxResult08('list_series_result',
+                                   fields={'name': name})
+                    for name in self.matching(query.split()[-1])]
+        # select * from <spec> order asc limit 1
+        return [InfluxResult08(name, fields={'value': 1},
+                               timestamp=self.series[name])
+                for name in self.matching(query.split()[3])]
+
+LIST_SPEC = r'/^xioprop\..*/'
+DAY = ROLLUP_INTERVAL
+NOW = 1450051200
+
+class ListSeriesTest(unittest.TestCase):
+    def test_raw_only(self):
+        executor = FakeExecutor({'xioprop.a': 0, 'xioprop.b': 0})
+        self.assertEqual(list_series(executor, LIST_SPEC),
+                         {'xioprop.a': 'xioprop.a', 'xioprop.b': 'xioprop.b'})
+
+    def test_no_rollups(self):
+        executor = FakeExecutor({'xioprop.a': 0, 'daily.xioprop.a': 0})
+        self.assertEqual(list_series(executor, LIST_SPEC, False),
+                         {'xioprop.a': 'xioprop.a'})
+        self.assertEqual(len(executor.queries), 1)
+
+    def test_series_without_rollup(self):
+        executor = FakeExecutor({'xioprop.a': 0, 'xioprop.b': 0,
+                                 'daily.xioprop.a': 0})
+        self.assertEqual(list_series(executor, LIST_SPEC),
+                         {'daily.xioprop.a': 'xioprop.a',
+                          'xioprop.b': 'xioprop.b'})
+
+    def test_rollup_covering_range(self):
+        since = NOW - 120 * DAY
+        executor = FakeExecutor({'xioprop.a': 0, 'xioprop.b': 0,
+                                 'xioprop.c': 0,
+                                 # filled in over the range
+                                 'daily.xioprop.a': since - since % DAY,
+                                 # only the last week
+                                 'daily.xioprop.b': NOW - 7 * DAY})
+        self.assertEqual(list_series(executor, LIST_SPEC, since=since),
+                         {'daily.xioprop.a': 'xioprop.a',
+                          'xioprop.b': 'xioprop.b',
+                          'xioprop.c': 'xioprop.c'})
+        self.assertTrue("select * from %s order asc limit 1" %
+                        rollup_list_spec(LIST_SPEC) in executor.queries)
+
+    def test_rollup_without_series(self):
+        # the raw series has expired
+        executor = FakeExecutor({'daily.xioprop.a': NOW - 200 * DAY})
+        self.assertEqual(list_series(executor, LIST_SPEC,
+                                     since=NOW - 120 * DAY),
+                         {'daily.xioprop.a': 'xioprop.a'})
+        executor = FakeExecutor({'daily.xioprop.a': NOW - 7 * DAY})
+        self.assertEqual(list_series(executor, LIST_SPEC,
+                                     since=NOW - 120 * DAY), {})
+
+class DailyExecutor(object):
+    """Answers the queries of downsample with a daily bucket of series a for
+       each day from the start of the query's time range"""
+    def __init__(self, dsn, workers=1):
+        self.queries = []
+
+    def query_results(self, query):
+        if query.startswith("list"):
+            return [InfluxResult08('list_series_result',
+                                   fields={'name': 'xioprop.a'})]
+        return []
+
+    def query_series(self, query, names):
+        self.queries.append(query)
+        since = int(re.search(r"time > (\d+)s", query).group(1))
+        # group by time(1d) buckets start at midnight, the first holding
+        # whatever part of its day is in the range
+        first = since - since % DAY
+        return {'xioprop.a': [InfluxResult08('xioprop.a', timestamp=t,
+                                             fields={'value': 1})
+                              for t in range(first, NOW, DAY)]}
+
+class DownsampleTest(unittest.TestCase):
+    def setUp(self):
+        self.saved = (downsample.QueryExecutor, downsample.write_results)
+        self.executors = []
+        def executor(dsn, workers=1):
+            self.executors.append(DailyExecutor(dsn, workers))
+            return self.executors[-1]
+        downsample.QueryExecutor = executor
+        downsample.write_results = lambda dsn, points: True
+
+    def tearDown(self):
+        downsample.QueryExecutor, downsample.write_results = self.saved
+
+    def test_starts_on_a_day(self):
+        now = NOW + DAY / 2
+        points = downsample.downsample('influxdb://u:p@localhost:8086/d',
+                                       {LIST_SPEC: ['value']}, days=3,
+                                       now=now)
+        # the range is rounded down to the start of the day, so the first
+        # bucket is a whole day too
+        self.assertEqual([ts.timestamp for ts in points],
+                         [NOW - 3 * DAY, NOW - 2 * DAY, NOW - DAY])
+        self.assertTrue("time > %ds" % (NOW - 3 * DAY - 1) in
+                        self.executors[0].queries[0])
+        self.assertTrue(all(ts.timestamp % DAY == 0 for ts in points))
+
+if __name__ == '__main__':
+    unittest.main()
+
+# vim: et:ai:sw=4:ts=4
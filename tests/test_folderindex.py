@@ -0,0 +1,203 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from pyVsphereInflux.tools.folderindex import FolderScope, FolderIndex
+from pyVsphereInflux.tools.regex import convert_to_alnum
+from pyVsphereInflux.vsphere import apply_folder_updates
+
+ROOT = 'group-v1'
+
+def make_scope():
+    scope = FolderScope('uuid-1/group-v1', ROOT)
+    scope.set_folder('group-v2', 'Prod', ROOT)
+    scope.set_folder('group-v3', 'Web Servers', 'group-v2')
+    scope.set_folder('group-v4', 'Test', ROOT)
+    scope.resolve(convert_to_alnum)
+    return scope
+
+class FolderScopeTest(unittest.TestCase):
+    def test_resolve(self):
+        scope = make_scope()
+        self.assertEqual(scope.paths['group-v3'],
+                         ('/Prod/Web Servers', '.Prod.Web_Servers'))
+        self.assertEqual(scope.lookup('group-v3', 'vmprop.vc1'),
+                         ('/Prod/Web Servers', 'vmprop.vc1.Prod.Web_Servers'))
+        self.assertEqual(scope.lookup(ROOT, 'vmprop.vc1'), ('', 'vmprop.vc1'))
+
+    def test_rename(self):
+        scope = make_scope()
+        scope.lookup('group-v3', 'vmprop.vc1')
+        scope.dirty = set()
+
+        scope.set_folder('group-v2', 'Production', ROOT)
+        scope.resolve(convert_to_alnum)
+        # the renamed folder and everything below it
+        self.assertEqual(scope.dirty, set(['group-v2', 'group-v3']))
+        self.assertEqual(scope.lookup('group-v3', 'vmprop.vc1'),
+                         ('/Production/Web Servers',
+                          'vmprop.vc1.Production.Web_Servers'))
+
+    def test_move(self):
+        scope = make_scope()
+        scope.dirty = set()
+
+        scope.set_folder('group-v3', 'Web Servers', 'group-v4')
+        scope.resolve(convert_to_alnum)
+        self.assertEqual(scope.dirty, set(['group-v3']))
+        self.assertEqual(scope.paths['group-v3'],
+                         ('/Test/Web Servers', '.Test.Web_Servers'))
+
+    def test_removal(self):
+        scope = make_scope()
+        scope.dirty = set()
+
+        scope.remove_folder('group-v2')
+        scope.resolve(convert_to_alnum)
+        # its child is orphaned, so no longer below the root either
+        self.assertEqual(scope.dirty, set(['group-v2', 'group-v3']))
+        self.assertEqual(scope.lookup('group-v2', 'vmprop.vc1'), None)
+        self.assertEqual(scope.lookup('group-v3', 'vmprop.vc1'), None)
+        self.assertEqual(scope.lookup('group-v4', 'vmprop.vc1'),
+                         ('/Test', 'vmprop.vc1.Test'))
+
+    def test_not_below_root(self):
+        scope = make_scope()
+        # the host folder of the datacenter, and a folder in it
+        scope.set_folder('group-h5', 'host', 'datacenter-2')
+        scope.set_folder('group-h6', 'Hosts', 'group-h5')
+        scope.resolve(convert_to_alnum)
+        self.assertFalse('group-h5' in scope.paths)
+        self.assertEqual(scope.lookup('group-h6', 'vmprop.vc1'), None)
+
+        # until it is moved under the root
+        scope.set_folder('group-h5', 'host', ROOT)
+        scope.resolve(convert_to_alnum)
+        self.assertEqual(scope.lookup('group-h6', 'vmprop.vc1'),
+                         ('/host/Hosts', 'vmprop.vc1.host.Hosts'))
+
+class FolderIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'folders.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_round_trip(self):
+        scope = make_scope()
+        scope.set_folder('group-h6', 'Hosts', 'group-h5')
+        scope.collector = 'session[1]2'
+        scope.version = '3'
+        index = FolderIndex(self.path)
+        index.save(scope)
+        self.assertEqual(scope.dirty, set())
+        index.close()
+
+        index = FolderIndex(self.path)
+        loaded = index.load(scope.scope, ROOT)
+        self.assertEqual((loaded.collector, loaded.version),
+                         ('session[1]2', '3'))
+        self.assertEqual(loaded.folders, scope.folders)
+        self.assertEqual(loaded.paths, scope.paths)
+        # folders not below the root are kept without a path
+        self.assertEqual(loaded.folders['group-h6'], ('Hosts', 'group-h5'))
+        self.assertFalse('group-h6' in loaded.paths)
+
+        # removals are saved too
+        loaded.remove_folder('group-v4')
+        loaded.resolve(convert_to_alnum)
+        index.save(loaded)
+        self.assertEqual(index.removed, 1)
+        self.assertFalse('group-v4' in
+                         index.load(scope.scope, ROOT).folders)
+        index.close()
+
+    def test_unknown_scope(self):
+        index = FolderIndex(self.path)
+        scope = index.load('uuid-1/group-v9', 'group-v9')
+        self.assertEqual((scope.collector, scope.version), (None, None))
+        self.assertEqual(scope.folders, {})
+        self.assertEqual(scope.paths, {'group-v9': ("", "")})
+        index.close()
+
+class Obj(object):
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+def ref(moid):
+    return Obj(_moId=moid)
+
+def obj_update(moid, kind, name=None, parent=None):
+    changes = []
+    if name is not None:
+        changes.append(Obj(name='name', val=name))
+    if parent is not None:
+        changes.append(Obj(name='parent', val=ref(parent)))
+    return Obj(obj=ref(moid), kind=kind, changeSet=changes)
+
+class FakeCollector(object):
+    """Answers WaitForUpdatesEx with a list of pages of object updates,
+       then None as there are no more changes"""
+    def __init__(self, pages, version=0):
+        self.pages = list(pages)
+        self.version = version
+        self.versions = []
+
+    def WaitForUpdatesEx(self, version, options):
+        self.versions.append(version)
+        if not self.pages:
+            return None
+        self.version += 1
+        return Obj(filterSet=[Obj(objectSet=self.pages.pop(0))],
+                   version=str(self.version))
+
+class ApplyFolderUpdatesTest(unittest.TestCase):
+    def test_initial(self):
+        scope = FolderScope('uuid-1/group-v1', ROOT)
+        collector = FakeCollector([
+            [obj_update('group-v2', 'enter', 'Prod', ROOT),
+             obj_update('group-v3', 'enter', 'Web', 'group-v2')],
+            [obj_update('group-v4', 'enter', 'Test', ROOT)]])
+        apply_folder_updates(collector, scope)
+
+        self.assertEqual(collector.versions, ["", "1", "2"])
+        self.assertEqual(scope.version, "2")
+        self.assertEqual(scope.paths['group-v3'], ('/Prod/Web', '.Prod.Web'))
+        self.assertEqual(scope.paths['group-v4'], ('/Test', '.Test'))
+
+    def test_changes(self):
+        scope = make_scope()
+        scope.version = "5"
+        collector = FakeCollector([
+            # a rename changes only the name
+            [obj_update('group-v2', 'modify', name='Production'),
+             obj_update('group-v3', 'modify', parent='group-v4'),
+             obj_update('group-v4', 'leave')]], version=5)
+        apply_folder_updates(collector, scope)
+
+        self.assertEqual(collector.versions, ["5", "6"])
+        self.assertEqual(scope.version, "6")
+        self.assertEqual(scope.lookup('group-v2', 'm'),
+                         ('/Production', 'm.Production'))
+        # moved into a folder that has since gone
+        self.assertEqual(scope.folders['group-v3'],
+                         ('Web Servers', 'group-v4'))
+        self.assertEqual(scope.lookup('group-v3', 'm'), None)
+        self.assertFalse('group-v4' in scope.folders)
+
+    def test_reload(self):
+        scope = make_scope()
+        collector = FakeCollector([
+            [obj_update('group-v2', 'enter', 'Prod', ROOT)]])
+        apply_folder_updates(collector, scope, reload=True)
+
+        # the folders the reload didn't include are forgotten
+        self.assertEqual(sorted(scope.folders), ['group-v2'])
+        self.assertEqual(sorted(scope.paths), ['group-v1', 'group-v2'])
+
+if __name__ == '__main__':
+    unittest.main()
+
+# vim: et:ai:sw=4:ts=4
@@ -0,0 +1,136 @@
+import os
+import imp
+import math
+import unittest
+
+import numpy as np
+
+from pyVsphereInflux.frame import frames_from_query, empty_frame
+from pyVsphereInflux.forecast import stack_series, fit_linear, solve_for_x, \
+                                     forecast, RegressionState
+
+SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir,
+                      'bin', 'storage-capacity-forecast.py')
+forecast_script = imp.load_source('storage_capacity_forecast', SCRIPT)
+
+class FitLinearTest(unittest.TestCase):
+    def fit(self, xs, ys):
+        x, x_mask = stack_series(xs)
+        y, y_mask = stack_series(ys)
+        return fit_linear(x, y, x_mask & y_mask)
+
+    def test_exact_lines(self):
+        slope, intercept, x_mean, y_mean = self.fit(
+            [[0, 1, 2, 3], [10, 20]],
+            [[1, 3, 5, 7], [5, 4]])
+        np.testing.assert_allclose(slope, [2.0, -0.1])
+        np.testing.assert_allclose(intercept, [1.0, 6.0])
+        np.testing.assert_allclose(x_mean, [1.5, 15.0])
+        np.testing.assert_allclose(y_mean, [4.0, 4.5])
+
+    def test_matches_polyfit(self):
+        rng = np.random.RandomState(1)
+        x = 1450000000 + np.arange(30) * 86400.0
+        y = 3e12 + 1e6 * (x - x[0]) + rng.normal(0, 1e9, len(x))
+        slope, intercept, x_mean, y_mean = self.fit([x], [y])
+        expected = np.polyfit(x - x[0], y, 1)
+        self.assertAlmostEqual(slope[0] / expected[0], 1.0, places=9)
+        # the intercept at the first x, as the epoch one loses precision
+        self.assertAlmostEqual((intercept[0] + slope[0] * x[0]) /
+                               expected[1], 1.0, places=9)
+
+    def test_missing_values(self):
+        slope, intercept, x_mean, y_mean = self.fit(
+            [[0, 1, 2, 3]], [[1, None, float('nan'), 7]])
+        np.testing.assert_allclose(slope, [2.0])
+        np.testing.assert_allclose(intercept, [1.0])
+
+    def test_degenerate_rows(self):
+        slope, intercept, x_mean, y_mean = self.fit(
+            [[5], [3, 3, 3], []], [[1], [1, 2, 3], []])
+        self.assertTrue(np.isnan(slope).all())
+        self.assertTrue(np.isnan(intercept).all())
+        self.assertTrue(np.isnan(x_mean[2]))
+
+class SolveForXTest(unittest.TestCase):
+    def test_solve(self):
+        x = solve_for_x(np.array([9.0, 0.0]), np.array([2.0, -0.1]),
+                        np.array([1.5, 15.0]), np.array([4.0, 4.5]))
+        np.testing.assert_allclose(x, [4.0, 60.0])
+
+    def test_flat_line_never_gets_there(self):
+        x = solve_for_x(np.array([10.0]), np.array([0.0]),
+                        np.array([1.0]), np.array([4.0]))
+        self.assertTrue(np.isinf(x[0]))
+
+    def test_no_fit(self):
+        x = solve_for_x(np.array([10.0]), np.array([np.nan]),
+                        np.array([np.nan]), np.array([np.nan]))
+        self.assertTrue(np.isnan(x[0]))
+
+class ForecastTest(unittest.TestCase):
+    def test_forecast(self):
+        day = 86400
+        res = forecast(['a', 'b'],
+                       [[0, day, 2 * day], [0]],
+                       [[10, 20, 30], [10]],
+                       [[100, 100, 100], [0]],
+                       now=2 * day)
+        self.assertAlmostEqual(res['a']['days_until_full'], 7.0)
+        self.assertAlmostEqual(res['a']['days_until_ninety_full'], 6.0)
+        self.assertAlmostEqual(res['a']['percent_used'], 30.0)
+        self.assertAlmostEqual(res['a']['latest_remaining'], 70.0)
+        # one point and no capacity
+        self.assertTrue(math.isnan(res['b']['days_until_full']))
+        self.assertTrue(math.isinf(res['b']['percent_used']))
+
+class RegressionStateTest(unittest.TestCase):
+    DAY = 86400
+
+    def state(self):
+        state = RegressionState(0)
+        for day in range(3):
+            state.add(day * self.DAY, 10.0 * (day + 1), 100.0)
+        return state
+
+    def test_expire_part(self):
+        state = self.state()
+        state.expire(0)
+        self.assertEqual(state.n, 2)
+        self.assertEqual(state.buckets,
+                         [[self.DAY, 20.0], [2 * self.DAY, 30.0]])
+        self.assertEqual(state.latest, [2 * self.DAY, 30.0, 100.0])
+        self.assertEqual(state.watermark, 2 * self.DAY)
+
+    def test_expire_all(self):
+        state = self.state()
+        state.expire(10 * self.DAY)
+        self.assertEqual((state.n, state.buckets), (0, []))
+        self.assertEqual((state.latest, state.watermark), (None, None))
+
+        # a longer window brings back buckets before the old watermark
+        state.add(self.DAY, 20.0, 200.0)
+        self.assertEqual(state.n, 1)
+        self.assertEqual(state.latest, [self.DAY, 20.0, 200.0])
+
+class ForecastRawTest(unittest.TestCase):
+    def test_missing_means(self):
+        day = 86400
+        # a bucket without points has None means
+        frame = frames_from_query([
+            {'name': 'a', 'columns': ['time', 'used', 'capacity'],
+             'points': [[0, 20, 200], [day, None, None], [2 * day, 60, None],
+                        [3 * day, 80, 200]]}])['a']
+        for column in ['used', 'capacity']:
+            frame.data[column] = frame.floats(column)
+        res = forecast_script.forecast_raw({'a': frame,
+                                            'b': empty_frame('b')})
+        self.assertEqual(res.keys(), ['a'])
+        self.assertAlmostEqual(res['a']['latest_used'], 80.0)
+        self.assertAlmostEqual(res['a']['latest_capacity'], 200.0)
+        self.assertAlmostEqual(res['a']['slope'] * day, 20.0)
+
+if __name__ == '__main__':
+    unittest.main()
+
+# vim: et:ai:sw=4:ts=4
@@ -0,0 +1,84 @@
+import unittest
+
+import numpy as np
+
+from pyVsphereInflux import InfluxResult08
+from pyVsphereInflux.frame import frames_from_query, empty_frame
+from pyVsphereInflux.query import QueryExecutor
+
+RESPONSE = [{'name': 'a',
+             'columns': ['time', 'sequence_number', 'used', 'capacity',
+                         'state'],
+             'points': [[1450000000, 1, 10, 100.5, 'ok'],
+                        [1450086400, 2, 20, 100.5, 'ok']]},
+            {'name': 'b',
+             'columns': ['time', 'used'],
+             'points': [[1450000000, None], [1450086400, 3.5]]},
+            {'name': 'c', 'columns': ['time', 'used'], 'points': []}]
+
+class FramesFromQueryTest(unittest.TestCase):
+    def test_columns(self):
+        frames = frames_from_query(RESPONSE)
+        self.assertEqual(sorted(frames), ['a', 'b', 'c'])
+
+        a = frames['a']
+        self.assertEqual(len(a), 2)
+        self.assertEqual(a.columns, ['used', 'capacity', 'state'])
+        self.assertEqual(a.time.tolist(), [1450000000, 1450086400])
+        self.assertTrue(isinstance(a['used'], np.ndarray))
+        self.assertEqual(a['used'].tolist(), [10, 20])
+        self.assertEqual(a['state'], ['ok', 'ok'])
+        self.assertEqual(len(frames['c']), 0)
+
+    def test_missing_values(self):
+        b = frames_from_query(RESPONSE)['b']
+        # stays a list, which floats turns into NaN
+        self.assertEqual(b['used'], [None, 3.5])
+        used = b.floats('used')
+        self.assertTrue(np.isnan(used[0]))
+        self.assertEqual(used[1], 3.5)
+        self.assertTrue(np.isnan(b.floats('capacity')).all())
+
+    def test_to_results(self):
+        frames = frames_from_query(RESPONSE)
+        expected = InfluxResult08.from_query(RESPONSE)
+        results = frames['a'].to_results() + frames['b'].to_results()
+        self.assertEqual([ts.to_dict() for ts in results],
+                         [ts.to_dict() for ts in expected])
+
+    def test_empty_frame(self):
+        frame = empty_frame('x')
+        self.assertEqual(len(frame), 0)
+        self.assertEqual(frame.time.tolist(), [])
+        self.assertEqual(frame.floats('used').tolist(), [])
+        self.assertEqual(frame.to_results(), [])
+
+class FakeClient(object):
+    """Answers a query with the series of RESPONSE it selects FROM"""
+    def __init__(self):
+        self.queries = []
+
+    def query(self, query):
+        self.queries.append(query)
+        return [series for series in RESPONSE
+                if series['name'] in query.split("FROM")[1]]
+
+class QuerySeriesFramesTest(unittest.TestCase):
+    def test_query_series_frames(self):
+        executor = QueryExecutor('influxdb://u:p@localhost:8086/d',
+                                 workers=1, series_per_query=2)
+        client = FakeClient()
+        executor.local.client = client
+        frames = executor.query_series_frames("SELECT * FROM %(series)s",
+                                              ['a', 'b', 'd'])
+        # a and b in one regex query, d on its own
+        self.assertEqual(client.queries,
+                         ['SELECT * FROM /^(a|b)$/', 'SELECT * FROM "d"'])
+        self.assertEqual(sorted(frames), ['a', 'b', 'd'])
+        self.assertEqual(frames['a']['used'].tolist(), [10, 20])
+        self.assertEqual(len(frames['d']), 0)
+
+if __name__ == '__main__':
+    unittest.main()
+
+# vim: et:ai:sw=4:ts=4
@@ -0,0 +1,147 @@
+import os
+import imp
+import argparse
+import unittest
+
+from pyVsphereInflux import InfluxResult08
+from pyVsphereInflux.batch import InfluxBatch
+from pyVsphereInflux.influx import InfluxWriteError
+
+SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir,
+                      'bin', 'vsphere-influxdb-import.py')
+importer = imp.load_source('vsphere_influxdb_import', SCRIPT)
+
+def make_args(**kwargs):
+    args = argparse.Namespace(vcenter=['vc1', 'vc2'], debug=False,
+                              influx_dsn='influxdb://u:p@localhost:8086/d',
+                              batch_size=5000, write_workers=1,
+                              influx_protocol='json', precision='s',
+                              spool=None, spool_dir=None,
+                              rollup_levels=list(importer.rollup_levels))
+    for key in kwargs:
+        setattr(args, key, kwargs[key])
+    return args
+
+def vm_results(vcenter, count=2):
+    return [InfluxResult08('vmprop.%s' % vcenter,
+                           tags={'name': 'vm%d' % i,
+                                 'folderPath': '/dc/folder'},
+                           fields={'config.hardware.numCPU': 2})
+            for i in range(count)]
+
+class FakeCollector(object):
+    def __init__(self, vcenter):
+        self.vcenter = vcenter
+        self.polls = 0
+
+    def poll(self):
+        self.polls += 1
+        return 0
+
+    def snapshot(self):
+        return vm_results(self.vcenter)
+
+class FailingWriter(object):
+    """Stands in for write_results, failing the writes of the vCenters in
+       fail"""
+    def __init__(self, fail):
+        self.fail = set(fail)
+        self.written = []
+        self.calls = []
+
+    def __call__(self, dsn, results, **kwargs):
+        self.calls.append(results)
+        vcenters = set(ts.tags['vcenter'] for ts in results)
+        if vcenters & self.fail:
+            raise InfluxWriteError([None], [IOError("connection refused")])
+        self.written.extend(results)
+        return True
+
+class PollVcentersTest(unittest.TestCase):
+    def setUp(self):
+        self.write_results = importer.write_results
+
+    def tearDown(self):
+        importer.write_results = self.write_results
+
+    def test_failing_write(self):
+        writer = FailingWriter(['vc1'])
+        importer.write_results = writer
+        collectors = dict((vc, FakeCollector(vc)) for vc in ['vc1', 'vc2'])
+        args = make_args()
+
+        importer.poll_vcenters(collectors, args)
+        self.assertEqual(set(ts.tags['vcenter'] for ts in writer.written),
+                         set(['vc2']))
+        self.assertEqual(sorted(collectors), ['vc1', 'vc2'])
+        self.assertTrue(isinstance(writer.calls[0], InfluxBatch))
+
+        # the next interval carries on with the same collectors
+        writer.fail = set()
+        importer.poll_vcenters(collectors, args)
+        self.assertTrue('vc1' in set(ts.tags['vcenter']
+                                     for ts in writer.written))
+        self.assertEqual([collectors[vc].polls for vc in ['vc1', 'vc2']],
+                         [2, 2])
+
+class CollectVcenterTest(unittest.TestCase):
+    def setUp(self):
+        self.saved = dict((name, getattr(importer, name))
+                          for name in ['write_results', 'connect_vcenter',
+                                       'build_vmresultset',
+                                       'iter_vmresultset'])
+        self.writer = FailingWriter([])
+        importer.write_results = self.writer
+        importer.connect_vcenter = lambda vcenter, args: object()
+
+    def tearDown(self):
+        for name in self.saved:
+            setattr(importer, name, self.saved[name])
+
+    def collect(self, **kwargs):
+        options = dict(deadline=60, inventory=False, single_pass=False,
+                       page_size=2, folder_index=None)
+        options.update(kwargs)
+        args = make_args(**options)
+        return importer.collect_vcenter('vc1', args, {})
+
+    def measurements(self):
+        return [ts.measurement for ts in self.writer.written]
+
+    def test_complete(self):
+        importer.build_vmresultset = \
+            lambda *args, **kwargs: vm_results('vc1', 3)
+        self.assertTrue(self.collect())
+        self.assertEqual(self.measurements().count('vmprop.vc1'), 3)
+        self.assertTrue('vmagg_vcenter.vc1' in self.measurements())
+        # the vms go to the writer as batches
+        self.assertEqual([len(x) for x in self.writer.calls
+                          if isinstance(x, InfluxBatch)], [2, 1])
+
+    def test_deadline_before_anything_is_sent(self):
+        def build_vmresultset(*args, **kwargs):
+            self.assertTrue(kwargs['deadline'] is not None)
+            raise importer.DeadlineExceeded()
+        importer.build_vmresultset = build_vmresultset
+        self.assertFalse(self.collect())
+        self.assertEqual(self.writer.written, [])
+
+    def test_deadline_part_way(self):
+        def iter_vmresultset(*args, **kwargs):
+            for ts in vm_results('vc1', 3):
+                yield ts
+            raise importer.DeadlineExceeded()
+        importer.iter_vmresultset = iter_vmresultset
+        self.assertFalse(self.collect(single_pass=True))
+
+        # the chunk of two written and the aggregates of just those
+        self.assertEqual(self.measurements().count('vmprop.vc1'), 2)
+        aggregate = [ts for ts in self.writer.written
+                     if ts.measurement == 'vmagg_vcenter.vc1']
+        self.assertEqual(len(aggregate), 1)
+        self.assertEqual(aggregate[0].fields['config.hardware.numCPU'], 4)
+
+if __name__ == '__main__':
+    unittest.main()
+
+# vim: et:ai:sw=4:ts=4
@@ -0,0 +1,40 @@
+import unittest
+
+from pyVsphereInflux import InfluxResult08
+from pyVsphereInflux.batch import InfluxBatch
+
+def lines(results):
+    """The lines of a list of results, both one at a time and as a batch,
+       which must agree"""
+    single = [ts.to_line() for ts in results]
+    batch = InfluxBatch.from_results(results).to_lines()
+    assert single == batch, (single, batch)
+    return single
+
+class NonFiniteTest(unittest.TestCase):
+    def test_skipped_like_none(self):
+        results = [InfluxResult08('m', fields={'a': 1.5, 'b': float('nan')},
+                                  timestamp=10),
+                   InfluxResult08('m', fields={'a': float('inf'),
+                                               'b': float('-inf')},
+                                  timestamp=20),
+                   InfluxResult08('m', fields={'a': 2.5, 'b': None},
+                                  timestamp=30)]
+        self.assertEqual(lines(results), ['m a=1.5 10', None, 'm a=2.5 30'])
+
+class NewlineTest(unittest.TestCase):
+    def test_tags_and_measurement(self):
+        ts = InfluxResult08('vm\nprop', tags={'name': 'a\r\nb', 'os': 'c'},
+                            fields={'value': 1}, timestamp=10)
+        self.assertEqual(lines([ts]),
+                         ['vm\\ prop,name=a\\ b,os=c value=1i 10'])
+
+    def test_string_field(self):
+        ts = InfluxResult08('m', fields={'notes': 'line 1\nline "2"'},
+                            timestamp=10)
+        self.assertEqual(lines([ts]), ['m notes="line 1 line \\"2\\"" 10'])
+
+if __name__ == '__main__':
+    unittest.main()
+
+# vim: et:ai:sw=4:ts=4
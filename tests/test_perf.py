@@ -0,0 +1,120 @@
+import os
+import imp
+import json
+import shutil
+import argparse
+import tempfile
+import unittest
+
+from pyVsphereInflux import InfluxResult08
+from pyVsphereInflux.perf import CounterCatalog
+
+SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir,
+                      'bin', 'vsphere-perf-import.py')
+importer = imp.load_source('vsphere_perf_import', SCRIPT)
+
+class Obj(object):
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+def counter(key, name):
+    group, counter_name, rollup = name.split('.')
+    return Obj(key=key, groupInfo=Obj(key=group),
+               nameInfo=Obj(key=counter_name), rollupType=rollup)
+
+def service_instance(counters):
+    perf_manager = Obj(perfCounter=[counter(key, name)
+                                    for key, name in counters])
+    return Obj(content=Obj(about=Obj(instanceUuid='uuid-1'),
+                           perfManager=perf_manager))
+
+class CounterCatalogTest(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def test_reload_stale_cache(self):
+        with open(os.path.join(self.cache_dir, 'uuid-1.json'), 'w') as f:
+            json.dump({'cpu.usage.average': 2}, f)
+        si = service_instance([(2, 'cpu.usage.average'),
+                               (24, 'mem.usage.average')])
+
+        catalog = CounterCatalog(si, cache_dir=self.cache_dir)
+        self.assertEqual(catalog.ids(['cpu.usage.average']), [2])
+        self.assertEqual(catalog.ids(['cpu.usage.average',
+                                      'mem.usage.average']), [2, 24])
+        self.assertEqual(catalog.names[24], 'mem.usage.average')
+
+        # the cache is updated for the next run
+        with open(os.path.join(self.cache_dir, 'uuid-1.json')) as f:
+            self.assertEqual(json.load(f)['mem.usage.average'], 24)
+
+    def test_unknown_counter(self):
+        si = service_instance([(2, 'cpu.usage.average')])
+        catalog = CounterCatalog(si, cache_dir=self.cache_dir)
+        self.assertRaises(KeyError, catalog.ids, ['cpu.bogus.average'])
+
+        # the cached catalog is reloaded once, then still fails
+        catalog = CounterCatalog(si, cache_dir=self.cache_dir)
+        self.assertTrue(catalog.cached)
+        self.assertRaises(KeyError, catalog.ids, ['cpu.bogus.average'])
+        self.assertFalse(catalog.cached)
+
+class CollectVcenterTest(unittest.TestCase):
+    def setUp(self):
+        self.saved = dict((name, getattr(importer, name))
+                          for name in ['connect', 'CounterCatalog',
+                                       'get_powered_on_vms', 'collect_perf',
+                                       'write_results'])
+        importer.connect = Obj(SmartConnect=lambda **kwargs: object(),
+                               Disconnect=lambda si: None)
+        importer.CounterCatalog = lambda si, cache_dir=None: None
+        importer.get_powered_on_vms = lambda si, page_size=None: {}
+        self.written = []
+        importer.write_results = \
+            lambda dsn, results: self.written.extend(results)
+
+    def tearDown(self):
+        for name in self.saved:
+            setattr(importer, name, self.saved[name])
+
+    def run_vcenters(self):
+        args = argparse.Namespace(vcenter=['vc1', 'vc2'], vs_username='u',
+                                  vs_password='p', vs_port=443,
+                                  counter_cache=None, page_size=None,
+                                  batch_size=50, workers=1, max_sample=1,
+                                  influx_dsn='influxdb://u:p@localhost:8086/d',
+                                  debug=False)
+        return [importer.collect_vcenter(vcenter, args, ['cpu.usage.average'])
+                for vcenter in args.vcenter]
+
+    def test_failing_collection(self):
+        def collect_perf(si, vms, counters, measurement, **kwargs):
+            if measurement == 'vmperf.vc1':
+                raise KeyError("unknown performance counter %s" % counters[0])
+            return [InfluxResult08(measurement, fields={'value': 1})]
+        importer.collect_perf = collect_perf
+
+        self.assertEqual(self.run_vcenters(), [False, True])
+        self.assertEqual([ts.tags['vcenter'] for ts in self.written],
+                         ['vc2'])
+
+    def test_failing_write(self):
+        importer.collect_perf = lambda si, vms, counters, measurement, \
+            **kwargs: [InfluxResult08(measurement, fields={'value': 1})]
+        def write_results(dsn, results):
+            if results[0].tags['vcenter'] == 'vc1':
+                raise IOError("connection refused")
+            self.written.extend(results)
+        importer.write_results = write_results
+
+        self.assertEqual(self.run_vcenters(), [False, True])
+        self.assertEqual([ts.tags['vcenter'] for ts in self.written],
+                         ['vc2'])
+
+if __name__ == '__main__':
+    unittest.main()
+
+# vim: et:ai:sw=4:ts=4
@@ -0,0 +1,114 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from pyVsphereInflux.tools.querycache import QueryCache, query_end, \
+                                             window_end
+
+class FakeClient(object):
+    _username = 'u'
+    _host = 'h'
+    _port = 8086
+    _database = 'd'
+
+    def __init__(self):
+        self.queries = []
+
+    def query(self, query):
+        self.queries.append(query)
+        return [{'name': 's', 'columns': ['time', 'v'],
+                 'points': [[1450000000, len(self.queries)]]}]
+
+class QueryEndTest(unittest.TestCase):
+    def test_ends(self):
+        self.assertEqual(query_end("select * from s where time < 1400000000s"),
+                         1400000000)
+        self.assertEqual(query_end("select * from s where time > 1s and "
+                                   "time <= 1400000000000ms"), 1400000000)
+        self.assertEqual(query_end("select * from s "
+                                   "where time < '2015-01-01'"), 1420070400)
+
+    def test_open_ended(self):
+        self.assertEqual(query_end("select * from s where time > now() - 1d"),
+                         None)
+        self.assertEqual(query_end("select * from s where time > 1s"), None)
+
+    def test_window_end(self):
+        self.assertEqual(window_end(86400, now=1450000000.5), 1449964800)
+        self.assertEqual(window_end(86400, now=1449964800), 1449964800)
+        end = window_end(7 * 86400, now=1450000000)
+        self.assertEqual(end % (7 * 86400), 0)
+        self.assertTrue(1450000000 - 7 * 86400 < end <= 1450000000)
+
+class QueryCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_hit(self):
+        cache = QueryCache(self.directory)
+        client = FakeClient()
+        first = cache.query(client, "select v from s")
+        second = cache.query(client, "select  v\nfrom s")
+        self.assertEqual(first, second)
+        self.assertEqual(len(client.queries), 1)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_expired(self):
+        cache = QueryCache(self.directory, ttl=-1)
+        client = FakeClient()
+        cache.query(client, "select v from s")
+        cache.query(client, "select v from s")
+        self.assertEqual(len(client.queries), 2)
+
+    def test_past_only(self):
+        cache = QueryCache(self.directory, past_only=True)
+        client = FakeClient()
+        for i in range(2):
+            cache.query(client, "select v from s where time > now() - 1d")
+        self.assertEqual(len(client.queries), 2)
+        self.assertEqual((cache.hits, cache.misses), (0, 0))
+
+        end = window_end(86400)
+        query = "select v from s where time > %ds and time < %ds" % \
+            (end - 86400, end)
+        for i in range(2):
+            cache.query(client, query)
+        self.assertEqual(len(client.queries), 3)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_evict_by_size(self):
+        client = FakeClient()
+        cache = QueryCache(self.directory)
+        cache.query(client, "select v from s")
+        size = os.path.getsize(os.path.join(self.directory,
+                                            os.listdir(self.directory)[0]))
+
+        cache = QueryCache(self.directory, max_bytes=int(size * 2.5))
+        for i in range(5):
+            cache.query(client, "select v from s limit %d" % i)
+        self.assertEqual(len(os.listdir(self.directory)), 2)
+        self.assertTrue(cache.size <= cache.max_bytes)
+
+    def test_evict_only_when_full(self):
+        cache = QueryCache(self.directory)
+        client = FakeClient()
+        evictions = []
+        evict = cache._evict
+        def counting_evict():
+            evictions.append(1)
+            evict()
+        cache._evict = counting_evict
+        for i in range(10):
+            cache.query(client, "select v from s limit %d" % i)
+        # only to count the bytes used on the first put
+        self.assertEqual(len(evictions), 1)
+        self.assertEqual(len(os.listdir(self.directory)), 10)
+
+if __name__ == '__main__':
+    unittest.main()
+
+# vim: et:ai:sw=4:ts=4
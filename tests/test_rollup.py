@@ -0,0 +1,221 @@
+import random
+import unittest
+
+from pyVsphereInflux import InfluxResult08
+from pyVsphereInflux.batch import InfluxBatch
+from pyVsphereInflux.rollup import RollupLevel, Rollup, rollup
+from pyVsphereInflux.tools.regex import convert_to_alnum
+
+# the aggregates of vsphere-influxdb-import.py before the rollup engine,
+# which its default levels have to reproduce
+def agg_by_vcenter(results):
+    # agg_toplevelfolder is dictionary whose values are
+    # InfluxResults
+    # agg_vcenter['vcenter']
+    agg_vcenter = {}
+    meas_base = "vmagg_vcenter"
+    for ts in results:
+        vcenter = convert_to_alnum(ts.tags['vcenter'])
+
+        # new vcenter, which means new aggregrate
+        if vcenter not in agg_vcenter:
+            agg_obj = InfluxResult08("%s.%s" % (meas_base, vcenter))
+            for tag in ['vcenter']:
+                agg_obj.tags[tag] = ts.tags[tag]
+            for field in ts.fields:
+                agg_obj.fields[field] = ts.fields[field]
+            agg_obj.timestamp = ts.timestamp
+            agg_vcenter[vcenter] = agg_obj
+        else:
+            agg_obj = agg_vcenter[vcenter]
+            # aggregate on fields
+            for field in ts.fields:
+                if field not in agg_obj.fields:
+                    agg_obj.fields[field] = ts.fields[field]
+                elif type(agg_obj.fields[field]) in (int, long, float):
+                    agg_obj.fields[field] += ts.fields[field]
+
+    # now flatten to a list
+    ret = []
+    for vcenter in agg_vcenter:
+        ret.append(agg_vcenter[vcenter])
+
+    return ret
+
+def agg_by_topLevelFolder(results):
+    # agg_toplevelfolder is a set of nested dictionaries whose values are
+    # InfluxResults
+    # agg_toplevelfolder['vcenter']['datacenter']['afolder']
+    agg_topLevelFolder = {}
+    meas_base = "vmagg_topLevelFolder"
+    for ts in results:
+        vcenter = convert_to_alnum(ts.tags['vcenter'])
+        datacenter = convert_to_alnum(ts.tags['datacenter'])
+        topLevelFolder = convert_to_alnum(ts.tags['topLevelFolder'])
+
+        # new vcenter
+        if vcenter not in agg_topLevelFolder:
+            agg_topLevelFolder[vcenter] = {}
+
+        # new datacenter 
+        if datacenter not in agg_topLevelFolder[vcenter]:
+            agg_topLevelFolder[vcenter][datacenter] = {}
+
+        # new topLevelFolder, which means new aggregrate
+        if topLevelFolder not in agg_topLevelFolder[vcenter][datacenter]:
+            agg_obj = InfluxResult08("%s.%s.%s.%s" % \
+                (meas_base, vcenter, datacenter, topLevelFolder))
+            for tag in ['vcenter', 'datacenter', 'topLevelFolder']:
+                agg_obj.tags[tag] = ts.tags[tag]
+            for field in ts.fields:
+                agg_obj.fields[field] = ts.fields[field]
+            agg_obj.timestamp = ts.timestamp
+            agg_topLevelFolder[vcenter][datacenter][topLevelFolder] = agg_obj
+        else:
+            agg_obj = agg_topLevelFolder[vcenter][datacenter][topLevelFolder] 
+            # aggregate on fields
+            for field in ts.fields:
+                if field not in agg_obj.fields:
+                    agg_obj.fields[field] = ts.fields[field]
+                elif type(agg_obj.fields[field]) in (int, long, float):
+                    agg_obj.fields[field] += ts.fields[field]
+
+    # now flatten to a list
+    ret = []
+    for vcenter in agg_topLevelFolder:
+        for datacenter in agg_topLevelFolder[vcenter]:
+            for topLevelFolder in agg_topLevelFolder[vcenter][datacenter]:
+                ret.append(
+                    agg_topLevelFolder[vcenter][datacenter][topLevelFolder])
+
+    return ret
+
+DEFAULT_LEVELS = [RollupLevel('vmagg_topLevelFolder',
+                              ['vcenter', 'datacenter', 'topLevelFolder']),
+                  RollupLevel('vmagg_vcenter', ['vcenter'])]
+
+def vm_results(count, seed=1):
+    """Build results shaped like tagged vsphere-influxdb-import.py output"""
+    rng = random.Random(seed)
+    results = []
+    for i in range(count):
+        folder = rng.choice(["Prod", "Dev", "Test Lab", "Test_Lab"])
+        ts = InfluxResult08("vmprop.vc.dc.vm%d" % i, timestamp=1450000000)
+        ts.tags['name'] = "vm%d" % i
+        ts.tags['vcenter'] = rng.choice(["vc1.example.com", "vc 2"])
+        ts.tags['datacenter'] = rng.choice(["DC1", "DC 2"])
+        ts.tags['folderPath'] = "/%s/sub%d" % (folder, i % 3)
+        ts.tags['topLevelFolder'] = folder
+        ts.fields['config.hardware.numCPU'] = rng.randint(1, 8)
+        ts.fields['config.hardware.memoryMB'] = 1024 * rng.randint(1, 8)
+        ts.fields['guest.guestState'] = rng.choice(["running",
+                                                    "notRunning"])
+        ts.fields['summary.storage.committed'] = rng.randint(1, 10**11)
+        results.append(ts)
+    return results
+
+def by_measurement(results):
+    return dict((ts.measurement, (ts.tags, ts.fields, ts.timestamp))
+                for ts in results)
+
+class RollupTest(unittest.TestCase):
+    def assertSameAggregates(self, a, b):
+        self.assertEqual(len(a), len(b))
+        self.assertEqual(by_measurement(a), by_measurement(b))
+
+    def test_matches_old_aggregates(self):
+        results = vm_results(500)
+        expected = agg_by_topLevelFolder(results) + agg_by_vcenter(results)
+        self.assertSameAggregates(rollup(results, DEFAULT_LEVELS), expected)
+
+    def test_batch_matches_old_aggregates(self):
+        results = vm_results(500)
+        expected = agg_by_topLevelFolder(results) + agg_by_vcenter(results)
+        batch = InfluxBatch.from_results(results)
+        self.assertSameAggregates(rollup(batch, DEFAULT_LEVELS), expected)
+
+    def test_chunks_match_old_aggregates(self):
+        results = vm_results(500)
+        expected = agg_by_topLevelFolder(results) + agg_by_vcenter(results)
+        engine = Rollup(DEFAULT_LEVELS)
+        for start in range(0, len(results), 64):
+            engine.add_all(InfluxBatch.from_results(results[start:start + 64]))
+        self.assertSameAggregates(engine.results(), expected)
+
+    def test_batch_keeps_order(self):
+        results = vm_results(200)
+        batch = InfluxBatch.from_results(results)
+        self.assertEqual([ts.measurement
+                          for ts in rollup(results, DEFAULT_LEVELS)],
+                         [ts.measurement
+                          for ts in rollup(batch, DEFAULT_LEVELS)])
+
+    def test_folder_depth(self):
+        results = vm_results(100)
+        levels = [RollupLevel('agg', ['folder2'], 'count')]
+        batch = InfluxBatch.from_results(results)
+        for res in (rollup(results, levels), rollup(batch, levels)):
+            counts = dict((ts.tags['folder2'],
+                           ts.fields['config.hardware.numCPU'])
+                          for ts in res)
+            self.assertEqual(sum(counts.values()), 100)
+            self.assertTrue(all(key.count('/') == 1 for key in counts))
+
+    def test_rows_missing_a_key_are_left_out(self):
+        results = vm_results(10)
+        del results[3].tags['datacenter']
+        levels = [RollupLevel('agg', ['datacenter'], 'count')]
+        for res in (rollup(results, levels),
+                    rollup(InfluxBatch.from_results(results), levels)):
+            self.assertEqual(sum(ts.fields['config.hardware.numCPU']
+                                 for ts in res), 9)
+
+    def points_with_gaps(self):
+        values = [5, None, 2, 9, None, 7]
+        results = []
+        for i, value in enumerate(values):
+            ts = InfluxResult08("m%d" % i, tags={'g': 'x'})
+            if i != 4:
+                ts.fields['a'] = value
+            ts.fields['b'] = i
+            results.append(ts)
+        return results
+
+    def test_accumulators_skip_none_and_missing(self):
+        results = self.points_with_gaps()
+        expected = {'sum': 23, 'min': 2, 'max': 9, 'mean': 23 / 4.0}
+        for accumulator, value in expected.items():
+            levels = [RollupLevel('agg', ['g'], accumulator)]
+            for res in (rollup(results, levels),
+                        rollup(InfluxBatch.from_results(results), levels)):
+                self.assertEqual(len(res), 1)
+                self.assertEqual(res[0].fields['a'], value)
+
+    def test_count(self):
+        results = self.points_with_gaps()
+        levels = [RollupLevel('agg', ['g'], 'count')]
+        for res in (rollup(results, levels),
+                    rollup(InfluxBatch.from_results(results), levels)):
+            self.assertEqual(res[0].fields, {'a': 5, 'b': 6})
+
+    def test_numeric_columns(self):
+        results = self.points_with_gaps()
+        for accumulator, value in (('sum', 15), ('min', 0), ('max', 5),
+                                   ('mean', 2.5)):
+            levels = [RollupLevel('agg', ['g'], accumulator)]
+            res = rollup(InfluxBatch.from_results(results), levels)
+            self.assertEqual(res[0].fields['b'], value)
+
+    def test_unsortable_keys(self):
+        results = vm_results(20)
+        results[0].tags['vcenter'] = 'caf\xc3\xa9'
+        results[1].tags['vcenter'] = u'caf\xe9 2'
+        levels = [RollupLevel('vmagg_vcenter', ['vcenter'])]
+        self.assertSameAggregates(
+            rollup(InfluxBatch.from_results(results), levels),
+            rollup(results, levels))
+
+if __name__ == '__main__':
+    unittest.main()
+
+# vim: et:ai:sw=4:ts=4
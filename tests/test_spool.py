@@ -0,0 +1,178 @@
+import os
+import time
+import fcntl
+import shutil
+import tempfile
+import threading
+import unittest
+
+from pyVsphereInflux import InfluxResult08
+from pyVsphereInflux.spool import Spool, OFFSET_SUFFIX
+
+class FakeWriter(object):
+    """Records the measurements of each batch, failing the writes listed
+       in fail_on by their number"""
+    def __init__(self, batch_size=5, fail_on=()):
+        self.batch_size = batch_size
+        self.fail_on = set(fail_on)
+        self.attempts = 0
+        self.batches = []
+
+    def write(self, results):
+        attempt = self.attempts
+        self.attempts += 1
+        if attempt in self.fail_on:
+            raise IOError("write %d failed" % attempt)
+        self.batches.append([ts.measurement for ts in results])
+
+    def written(self):
+        return [m for batch in self.batches for m in batch]
+
+def points(start, stop):
+    return [InfluxResult08('m%d' % i, tags={'t': 'x'}, fields={'a': i},
+                           timestamp=1450000000 + i)
+            for i in range(start, stop)]
+
+class SpoolTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.spool = Spool(self.directory)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def drain(self, writer, **kwargs):
+        kwargs.setdefault('backoff', 0)
+        return self.spool.drain(writer, **kwargs)
+
+    def test_append_and_drain(self):
+        self.spool.append(points(0, 7))
+        self.spool.append(points(7, 12))
+        writer = FakeWriter()
+        self.assertTrue(self.drain(writer))
+        self.assertEqual(writer.batches,
+                         [['m0', 'm1', 'm2', 'm3', 'm4'],
+                          ['m5', 'm6', 'm7', 'm8', 'm9'],
+                          ['m10', 'm11']])
+        self.assertEqual(self.spool.segments(), [])
+
+    def test_records_round_trip(self):
+        self.spool.append([InfluxResult08('m', tags={'t': 'x'},
+                                          fields={'a': 1.5, 'b': "s"})],
+                          timestamp=1450000000)
+        results = []
+        writer = FakeWriter()
+        writer.write = results.extend
+        self.assertTrue(self.drain(writer))
+        self.assertEqual(results[0].to_dict(),
+                         InfluxResult08('m', tags={'t': 'x'},
+                                        fields={'a': 1.5, 'b': "s"},
+                                        timestamp=1450000000).to_dict())
+
+    def test_failed_drain_keeps_points(self):
+        self.spool.append(points(0, 12))
+        self.assertFalse(self.drain(FakeWriter(fail_on=[0, 1, 2])))
+        self.assertEqual(len(self.spool.segments()), 1)
+
+        writer = FakeWriter()
+        self.assertTrue(self.drain(writer))
+        self.assertEqual(writer.written(), ['m%d' % i for i in range(12)])
+
+    def test_retry_within_drain(self):
+        self.spool.append(points(0, 7))
+        writer = FakeWriter(fail_on=[1])
+        self.assertTrue(self.drain(writer))
+        self.assertEqual(writer.written(), ['m%d' % i for i in range(7)])
+
+    def test_resume_after_partial_drain(self):
+        self.spool.append(points(0, 12))
+        # the first batch is written, the second fails every attempt
+        writer = FakeWriter(fail_on=[1, 2, 3])
+        self.assertFalse(self.drain(writer))
+        self.assertEqual(writer.written(), ['m%d' % i for i in range(5)])
+
+        writer = FakeWriter()
+        self.assertTrue(self.drain(writer))
+        self.assertEqual(writer.written(), ['m%d' % i for i in range(5, 12)])
+
+    def test_partial_line_is_kept(self):
+        self.spool.append(points(0, 3))
+        path = self.spool.segments()[-1]
+        with open(path, 'a') as f:
+            f.write('{"measurement": "torn"')
+        size = os.path.getsize(path)
+
+        writer = FakeWriter()
+        self.drain(writer)
+        self.assertEqual(writer.written(), ['m0', 'm1', 'm2'])
+        # the segment stays, with the offset before the partial line
+        self.assertEqual(self.spool.segments(), [path])
+        with open(path + OFFSET_SUFFIX) as f:
+            self.assertEqual(int(f.read()), size - len('{"measurement": "torn"'))
+
+        # appending ends the partial line, which is then skipped
+        self.spool.append(points(3, 5))
+        writer = FakeWriter()
+        self.assertTrue(self.drain(writer))
+        self.assertEqual(writer.written(), ['m3', 'm4'])
+        self.assertEqual(self.spool.segments(), [])
+
+    def test_new_segments(self):
+        spool = Spool(self.directory, segment_bytes=200)
+        for i in range(4):
+            spool.append(points(i * 2, i * 2 + 2))
+        self.assertTrue(len(spool.segments()) > 1)
+
+        writer = FakeWriter()
+        self.assertTrue(spool.drain(writer, backoff=0))
+        self.assertEqual(writer.written(), ['m%d' % i for i in range(8)])
+
+    def test_evict_by_size(self):
+        spool = Spool(self.directory, segment_bytes=200, max_bytes=500)
+        for i in range(10):
+            spool.append(points(i * 2, i * 2 + 2))
+        segments = spool.segments()
+        total = sum(os.path.getsize(x) for x in segments)
+        self.assertTrue(total <= 500 + 200)
+
+        # the newest points survive
+        writer = FakeWriter()
+        self.assertTrue(spool.drain(writer, backoff=0))
+        self.assertEqual(writer.written()[-2:], ['m18', 'm19'])
+        self.assertTrue('m0' not in writer.written())
+
+    def test_evict_by_age(self):
+        spool = Spool(self.directory, segment_bytes=100, max_age=3600)
+        spool.append(points(0, 2))
+        old = spool.segments()[0]
+        past = time.time() - 7200
+        os.utime(old, (past, past))
+        spool.append(points(2, 4))
+        spool.append(points(4, 6))
+        self.assertFalse(old in spool.segments())
+
+    def test_evict_keeps_newest_segment(self):
+        spool = Spool(self.directory, segment_bytes=10, max_bytes=0)
+        spool.append(points(0, 2))
+        spool.append(points(2, 4))
+        self.assertEqual(len(spool.segments()), 1)
+
+    def test_append_waits_for_lock(self):
+        # as another process draining or appending would hold it
+        fd = os.open(self.directory, os.O_RDONLY)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        thread = threading.Thread(target=self.spool.append,
+                                  args=(points(0, 1),))
+        thread.start()
+        try:
+            time.sleep(0.2)
+            self.assertEqual(self.spool.segments(), [])
+        finally:
+            os.close(fd)
+            thread.join()
+        self.assertEqual(len(self.spool.segments()), 1)
+
+if __name__ == '__main__':
+    unittest.main()
+
+# vim: et:ai:sw=4:ts=4
@@ -0,0 +1,68 @@
+import unittest
+
+from pyVsphereInflux.xio import parse_show, to_number, XMSError
+
+HEADER = "Cluster-Name Index State   Vol-Size UD-SSD-Space"
+ROWS = ["xio1         1     active  10.5T    20T",
+        "xio2         2     active  512G     1024G"]
+
+def output(*lines):
+    return "\r\n".join(lines) + "\r\n"
+
+class ParseShowTest(unittest.TestCase):
+    def assert_rows(self, rows):
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(rows[0]['Cluster-Name'], 'xio1')
+        self.assertEqual(rows[1]['Vol-Size'], '512G')
+        self.assertEqual(sorted(rows[0]), sorted(HEADER.split()))
+
+    def test_table(self):
+        rows = parse_show(output("show-clusters", HEADER, "", *ROWS),
+                          "show-clusters", 'Cluster-Name')
+        self.assert_rows(rows)
+
+    def test_without_name_key(self):
+        rows = parse_show(output("show-clusters", HEADER, *ROWS),
+                          "show-clusters")
+        self.assert_rows(rows)
+
+    def test_banner_before_header(self):
+        rows = parse_show(output("show-clusters",
+                                 "Warning: the XMS certificate expires soon",
+                                 "", HEADER, *ROWS),
+                          "show-clusters", 'Cluster-Name')
+        self.assert_rows(rows)
+
+    def test_row_with_command_name(self):
+        rows = parse_show(output("show-volumes",
+                                 "Volume-Name   Index Vol-Size",
+                                 "show-volumes  1     1T",
+                                 "vol2          2     2T"),
+                          "show-volumes", 'Volume-Name')
+        self.assertEqual([row['Volume-Name'] for row in rows],
+                         ['show-volumes', 'vol2'])
+
+    def test_no_header(self):
+        self.assertRaises(XMSError, parse_show,
+                          output("show-clusters", "Error: not permitted"),
+                          "show-clusters", 'Cluster-Name')
+        self.assertEqual(parse_show(output("show-clusters"), "show-clusters"),
+                         [])
+
+class ToNumberTest(unittest.TestCase):
+    def test_numbers(self):
+        self.assertEqual(to_number("12"), 12)
+        self.assertEqual(to_number("512G"), 512 * 2**30)
+        self.assertEqual(to_number("10.5T"), int(10.5 * 2**40))
+
+    def test_not_numbers(self):
+        self.assertEqual(to_number("active"), None)
+        # ends with a size symbol
+        self.assertEqual(to_number("ONLINE"), None)
+        self.assertEqual(to_number("1.2.3G"), None)
+        self.assertEqual(to_number(""), None)
+
+if __name__ == '__main__':
+    unittest.main()
+
+# vim: et:ai:sw=4:ts=4